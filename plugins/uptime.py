@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from sys_sensors_plugins import CollectorPlugin, Metric
+
+
+class Plugin(CollectorPlugin):
+    """Example collector plugin: system uptime and number of processes (enable with "plugins: enabled: uptime")."""
+
+    interval = 60
+    timeout = 2.
+    metrics = (Metric('uptime', 'Uptime', unit='h', icon='mdi:timer-outline'),
+               Metric('processes_count', 'Processes', icon='mdi:application'))
+
+    def collect(self) -> dict:
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        with open('/proc/loadavg') as f:
+            processes = f.read().split()[3].split('/')[1]
+        return {'uptime': '{0:.1f}'.format(uptime / 3600), 'processes_count': processes}
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from typing import Optional
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRate(object):
+    """Update interval of a collector chosen from its watched values.
+
+    Watched values are those whose key starts with a prefix in thresholds (prefix -> warning value).
+    A value at or above its warning gives min_interval, a rising value gives the interval that leaves
+    samples updates before it reaches the warning, otherwise the interval doubles. The shortest interval of
+    the collector values is used, it grows at most twice per update and stays within min and max interval.
+    """
+
+    def __init__(self, thresholds, min_interval=5., max_interval=600., samples=10):
+        self.thresholds = thresholds
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.samples = samples
+        self.last = {}
+
+    def threshold(self, key):
+        prefix = max((p for p in self.thresholds if key.startswith(p)), key=len, default=None)
+        return None if prefix is None else self.thresholds[prefix]
+
+    def interval(self, current, payload: dict, now=None) -> Optional[float]:
+        """Return new interval of collector that returned payload, None if payload has no watched values."""
+        if now is None:
+            now = time.monotonic()
+        target = None
+        for key, value in payload.items():
+            warning = self.threshold(key)
+            value = _to_float(value)
+            if warning is None or value is None:
+                continue
+            previous = self.last.get(key)
+            self.last[key] = (value, now)
+            if value >= warning:
+                interval = self.min_interval
+            elif previous is not None and value > previous[0] and now > previous[1]:
+                rate = (value - previous[0]) / (now - previous[1])
+                interval = (warning - value) / rate / self.samples
+            else:
+                interval = 2. * current
+            target = interval if target is None else min(target, interval)
+        if target is None:
+            return None
+        return max(self.min_interval, min(self.max_interval, 2. * current, target))
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import copy
+import functools
+import json
+import os
+import select
+import shlex
+import subprocess
+import threading
+import time
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+
+from sys_sensors_collectors import CollectorPool
+from sys_sensors_device import SensorsDevice
+from sys_sensors_mqtt import RESTART_SETTINGS, MainProcess
+from sys_sensors_smart import SmartCollector
+
+SECTION = '@@sys_sensors@@'
+# One round trip per update: memory, boot time, disks usage, temperature sensors.
+SNAPSHOT_SCRIPT = '''cat /proc/meminfo
+echo '{0}'
+grep '^btime' /proc/stat
+echo '{0}'
+df -kP 2>/dev/null
+echo '{0}'
+for h in /sys/class/hwmon/hwmon*; do
+  [ -r "$h/temp1_input" ] && echo "$(cat "$h/name") $(cat "$h/temp1_input")"
+done 2>/dev/null
+for z in /sys/class/thermal/thermal_zone*; do
+  [ -r "$z/temp" ] && echo "$(cat "$z/type") $(cat "$z/temp")"
+done 2>/dev/null
+'''.format(SECTION)
+TEMPERATURE_SENSORS = ('soc_thermal', 'sun4i_ts', 'cpu_thermal', 'cpu0_thermal')
+
+
+def parse_snapshot(output: bytes) -> dict:
+    """Parse SNAPSHOT_SCRIPT output. Values are computed the same way as psutil does."""
+    sections = output.decode('utf-8', 'replace').split(SECTION + '\n')
+    if len(sections) != 4:
+        raise ValueError('unexpected snapshot output')
+    meminfo = {}
+    for line in sections[0].splitlines():
+        key, _, value = line.partition(':')
+        if value.split():
+            meminfo[key] = int(value.split()[0])
+    memory_use = None
+    if meminfo.get('MemTotal'):
+        available = meminfo.get('MemAvailable', meminfo.get('MemFree', 0))
+        memory_use = round((meminfo['MemTotal'] - available) / meminfo['MemTotal'] * 100, 1)
+    boot_time = None
+    for line in sections[1].splitlines():
+        if line.startswith('btime'):
+            boot_time = float(line.split()[1])
+    partitions = {}
+    for line in sections[2].splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 6 or not fields[0].startswith('/dev/'):
+            continue
+        total, used, available = int(fields[1]), int(fields[2]), int(fields[3])
+        percent = round(used / (used + available) * 100, 1) if used + available else 0.
+        partitions[' '.join(fields[5:])] = (total * 1024, percent)
+    temperatures = {}
+    for line in sections[3].splitlines():
+        name, _, value = line.rpartition(' ')
+        name = name.replace('-', '_')
+        if name and name not in temperatures:
+            try:
+                temperatures[name] = int(value) / 1000.
+            except ValueError:
+                pass
+    return {'memory_use': memory_use, 'boot_time': boot_time, 'partitions': partitions,
+            'temperatures': temperatures}
+
+
+class HostSession(object):
+    """Persistent shell on a host: one long-running transport process (for example 'ssh host sh').
+
+    Scripts are written to its stdin, output is read up to a marker line, so every update reuses the same
+    connection. The process is restarted on the next run after an error or timeout.
+    """
+
+    def __init__(self, logger_obj, name, command, timeout=30.):
+        self.logger = logger_obj
+        self.name = name
+        self.command = command
+        self.timeout = timeout
+        self._process = None
+        self._buffer = b''
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self.logger.debug('Open session to {}: {}'.format(self.name, ' '.join(self.command)))
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, start_new_session=True)
+        self._buffer = b''
+
+    def _close(self):
+        if self._process is None:
+            return
+        try:
+            self._process.kill()
+            self._process.wait(1)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        for stream in (self._process.stdin, self._process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self._process = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _read_until(self, terminator: bytes, deadline: float) -> bytes:
+        fd = self._process.stdout.fileno()
+        while True:
+            index = self._buffer.find(terminator)
+            if index >= 0:
+                output = self._buffer[:index]
+                self._buffer = self._buffer[index + len(terminator):]
+                return output
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise TimeoutError('no answer from {} in {} seconds'.format(self.name, self.timeout))
+            data = os.read(fd, 65536)
+            if not data:
+                raise ConnectionError('session to {} closed'.format(self.name))
+            self._buffer += data
+
+    def run(self, script: str) -> bytes:
+        """Run shell script on the host, return its output. Raise OSError on connection error or timeout."""
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._close()
+                self._start()
+            self._counter += 1
+            marker = '@@sys_sensors_end_{}@@'.format(self._counter)
+            try:
+                self._process.stdin.write('{}\nprintf "\\n%s\\n" "{}"\n'.format(script, marker).encode('utf-8'))
+                self._process.stdin.flush()
+                return self._read_until('\n{}\n'.format(marker).encode('utf-8'), time.monotonic() + self.timeout)
+            except OSError:
+                self._close()
+                raise
+
+
+class RemoteSmartCollector(SmartCollector):
+    """SMART cache of a remote host, smartctl runs in its session (refreshed by RemoteHost.collect)."""
+
+    def __init__(self, logger_obj, session, smartctl='smartctl', interval=3600.):
+        super().__init__(logger_obj, interval)
+        self.session = session
+        self.smartctl = smartctl
+
+    def _smartctl(self, *args) -> Optional[dict]:
+        command = '{} --json {} 2>/dev/null'.format(self.smartctl, ' '.join(shlex.quote(arg) for arg in args))
+        try:
+            output = self.session.run(command)
+        except OSError as e:
+            self.logger.error('Error run smartctl {} on {}: {}'.format(' '.join(args), self.session.name, e))
+            return None
+        return self._parse_output(args, output)
+
+
+def host_settings(settings_dict, host) -> dict:
+    """Settings of the aggregator for a remote host device (named as the host, without agent metrics and
+    reboot/shutdown switches)."""
+    settings_dict = copy.copy(settings_dict)
+    settings_dict['device_name'] = host['name']
+    settings_dict['metrics'] = dict(settings_dict['metrics'], enabled=False)
+    settings_dict['reboot/shutdown'] = False
+    return settings_dict
+
+
+class RemoteHost(SensorsDevice):
+    """Sensors of a remote host, read over its persistent session and published by AggregatorProcess
+    with the shared MQTT client. Same sensors and discovery as MainProcess, device name is the host name."""
+
+    def __init__(self, logger_obj, settings_dict, host):
+        super().__init__(logger_obj, host_settings(settings_dict, host))
+        aggregator = self.settings['aggregator']
+        self.host = host
+        self.name = host['name']
+        self.session = HostSession(self.logger, host['name'],
+                                   [arg.format(address=host['address'], name=host['name'])
+                                    for arg in aggregator['transport']], aggregator['timeout'])
+        self.smart = RemoteSmartCollector(self.logger, self.session, aggregator['smartctl'],
+                                          self.settings['intervals']['smart'])
+        self.smart_due = 0.
+        self.snapshot = None
+        self.config_changed = False
+        for name, func in (('memory', lambda: {'memory_use': self.get_memory_usage()}),
+                           ('last_boot', lambda: {'last_boot': self.get_last_boot()}),
+                           ('disks', self.get_disks), ('devices', self.get_devices),
+                           ('temperature', self.get_temperatures)):
+            self.collectors.register(name, func, aggregator['timeout'])
+        # Sensors of the host are updated together.
+        self.scheduler.add('host', aggregator['interval'])
+
+    def collect(self):
+        """Read all sensors of the host (runs on aggregator thread pool). Return {host name: payload}."""
+        if self.settings['aggregator']['smartctl'] and time.monotonic() >= self.smart_due:
+            self.smart_due = time.monotonic() + self.smart.interval
+            self.smart.refresh()
+        self.snapshot = parse_snapshot(self.session.run(SNAPSHOT_SCRIPT))
+        if self.update_disks_list():
+            self.config_changed = True
+        payload = {}
+        for collector in self.collectors.collectors.values():
+            payload.update(collector.func())
+        return {self.name: payload}
+
+    def publish_update(self, payload, stale):
+        if self.config_changed and self.settings['homeassistant'] and self.connected:
+            self.config_changed = False
+            self.mqtt_send_config()
+        self.publish_state(dict(payload), list(self.collectors.collectors) if stale else [])
+
+    def reload_settings(self, settings_dict):
+        """Apply reloaded settings of the aggregator (publish options, topic, Home Assistant options)."""
+        settings = host_settings(settings_dict, self.host)
+        changed = [key for key in settings if key not in RESTART_SETTINGS and settings[key] != self.settings.get(key)]
+        if not changed:
+            return
+        identity = 'topic' in changed
+        session = identity or 'homeassistant' in changed
+        if self.connected and self.settings['homeassistant'] and (identity or not settings['homeassistant']):
+            # Remove configs of the old topic.
+            self.discovery.update({})
+            self.discovery.publish()
+        if session:
+            self.discovery.disconnected()
+        for key in changed:
+            self.settings[key] = settings[key]
+        if 'intervals' in changed:
+            self.smart.interval = self.settings['intervals']['smart']
+        if 'publish' in changed:
+            self.create_publish_filters()
+        if identity:
+            self.set_identity()
+        if self.connected and self.settings['homeassistant']:
+            if session:
+                self.discovery.connected(self.mqtt_client)
+                self.mqtt_send_switches_state()
+            self.mqtt_send_config()
+        self.delta.reset()
+
+    def get_temperatures(self):
+        return {'soc_temperature': self.get_temp()}
+
+    def read_soc_temperature(self):
+        for name in TEMPERATURE_SENSORS:
+            if name in self.snapshot['temperatures']:
+                return self.snapshot['temperatures'][name]
+        return None
+
+    def get_last_boot(self):
+        if self.snapshot['boot_time'] is None:
+            return '-1'
+        return str(self.as_local(self.utc_from_timestamp(self.snapshot['boot_time'])).isoformat())
+
+    def get_memory_usage(self):
+        return str(self.snapshot['memory_use'] if self.snapshot['memory_use'] is not None else '-1')
+
+    def update_disks_list(self):
+        # Disks are kept until the host answers again.
+        disks = list(self.snapshot['partitions']) if self.snapshot is not None else self.disks
+        devices = self.smart.get_devices()
+        update_config = set(disks) != set(self.disks) or devices.keys() != self.devices.keys()
+        self.disks = disks
+        self.devices = devices
+        return update_config
+
+    def get_devices(self):
+        return self.devices_payload(self.smart.get_records())
+
+    def get_disks(self):
+        disks_payload = {}
+        for mountpoint, (total, percent) in self.snapshot['partitions'].items():
+            if mountpoint in self.disks:
+                disk_ = mountpoint.replace('/', '_')
+                disk_ = disk_.replace(':\\', '')
+                disks_payload.update({
+                    'disk_use_{}'.format(disk_): str(percent),
+                    'disk_total_{}'.format(disk_): '{0:.1f}'.format(total / 1048576),
+                })
+        return disks_payload
+
+    def host_topic(self, name):
+        return '{}/{}/{}'.format(self.settings['topic'], self.identifier, name)
+
+
+class AggregatorProcess(MainProcess):
+    """MainProcess that also monitors remote hosts (settings 'aggregator: hosts').
+
+    Hosts are read concurrently (one session per host, at most 'aggregator: workers' at once) every
+    'aggregator: interval' seconds and published through the one MQTT connection, each host as its own
+    Home Assistant device.
+    """
+
+    def __init__(self, logger_obj, settings_dict):
+        super().__init__(logger_obj, settings_dict)
+        aggregator = self.settings['aggregator']
+        self.hosts = [RemoteHost(self.logger, self.settings, host) for host in aggregator['hosts']]
+        self.hosts_pool = CollectorPool(self.logger, aggregator['workers'])
+        # Force update commands of hosts run on the command executor of the aggregator.
+        self.host_commands = {}
+        commands = self.settings['commands']
+        for host in self.hosts:
+            # States of hosts are sent to the extra brokers of the aggregator.
+            host.brokers = self.brokers
+            self.hosts_pool.register(host.name, host.collect, aggregator['timeout'])
+            name = 'force_update_{}'.format(host.identifier)
+            self.host_commands[name] = host
+            self.commands.register(name, functools.partial(self.command_force_update_host, host),
+                                   commands['min_interval']['force_update'], commands['window'])
+        if self.hosts:
+            self.scheduler.add('hosts', aggregator['interval'])
+
+    def mqtt_update_sensors(self, names=None):
+        local = None if names is None else [name for name in names if name != 'hosts']
+        if local is None or local:
+            super().mqtt_update_sensors(local)
+        if names is None or 'hosts' in names:
+            self.update_hosts()
+
+    def update_hosts(self):
+        payload, stale = self.hosts_pool.collect()
+        for host in self.hosts:
+            if host.name in payload:
+                host.publish_update(payload[host.name], host.name in stale)
+
+    def create_mqtt_client(self):
+        client = super().create_mqtt_client()
+        for host in self.hosts:
+            host.mqtt_client = client
+        return client
+
+    def on_connect(self, client, userdata, flags, rc):
+        super().on_connect(client, userdata, flags, rc)
+        if rc != 0:
+            return
+        for host in self.hosts:
+            host.connected = True
+            if self.settings['homeassistant']:
+                host.update_disks_list()
+                host.discovery.connected(client)
+                host.mqtt_send_config()
+                host.mqtt_send_switches_state()
+            self.subscribe_host(host)
+
+    def subscribe_host(self, host):
+        (result, mid) = self.mqtt_client.subscribe(host.host_topic('force_update'))
+        if result != mqtt.MQTT_ERR_SUCCESS:
+            self.logger.error('Error subscribe to force update topic of {}'.format(host.name))
+
+    def on_disconnect(self, client, userdata, rc):
+        super().on_disconnect(client, userdata, rc)
+        for host in self.hosts:
+            host.connected = False
+            host.discovery.disconnected()
+
+    def on_message(self, client, userdata, message):
+        super().on_message(client, userdata, message)
+        for host in self.hosts:
+            if message.topic == host.discovery.fingerprint_topic:
+                host.discovery.verify(message.payload)
+            elif message.topic == host.host_topic('force_update') and message.payload == b'ON':
+                self.logger.debug('Force update command for {}'.format(host.name))
+                self.commands.submit('force_update_{}'.format(host.identifier))
+
+    def send_command_response(self, name, status, merged):
+        host = self.host_commands.get(name)
+        if host is None:
+            super().send_command_response(name, status, merged)
+        elif self.connected:
+            self.mqtt_client.publish(topic='{}/response'.format(host.host_topic('force_update')),
+                                     payload=json.dumps({'command': 'force_update', 'status': status,
+                                                         'merged': merged}),
+                                     qos=1, retain=False)
+
+    def reload_settings(self, settings):
+        force_update_topics = [host.host_topic('force_update') for host in self.hosts]
+        super().reload_settings(settings)
+        for host, topic in zip(self.hosts, force_update_topics):
+            # Current settings: restart settings keep their values.
+            host.reload_settings(self.settings)
+            if self.connected and host.host_topic('force_update') != topic:
+                self.mqtt_client.unsubscribe(topic)
+                self.subscribe_host(host)
+
+    def command_force_update_host(self, host):
+        host.delta.reset()
+        self.request_update(['hosts'])
+
+    def command_force_update(self):
+        for host in self.hosts:
+            host.delta.reset()
+        super().command_force_update()
+
+    def stop_workers(self):
+        super().stop_workers()
+        self.hosts_pool.stop()
+        for host in self.hosts:
+            host.session.close()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import time
+
+from sys_sensors_mqtt import SMART_START_DELAY, MainProcess
+
+# paho housekeeping (keepalive pings, retries) interval, seconds.
+MISC_INTERVAL = 5.
+
+
+class AsyncioMqttAdapter(object):
+    """Drives paho client socket from asyncio event loop instead of paho network thread."""
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc_task = None
+        self.loop_thread = threading.get_ident()
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def _call(self, func, *args):
+        # paho calls socket callbacks from other threads too (connect in executor, publish from workers).
+        if threading.get_ident() == self.loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._call(self._open, sock)
+
+    def on_socket_close(self, client, userdata, sock):
+        self._call(self._close, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    def _open(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        if self.misc_task is None or self.misc_task.done():
+            self.misc_task = self.loop.create_task(self._misc())
+
+    def _close(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    async def _misc(self):
+        while self.client.loop_misc() == 0:
+            await asyncio.sleep(MISC_INTERVAL)
+
+
+class AsyncMainProcess(MainProcess):
+    """MainProcess on asyncio event loop: one scheduler task instead of Timer threads chain,
+    MQTT client driven by the loop, SMART data read by asyncio subprocesses.
+
+    All paho callbacks run on the loop, so force update handling does not race with scheduled updates.
+    """
+
+    def __init__(self, logger_obj, settings_dict):
+        super().__init__(logger_obj, settings_dict)
+        self.loop = None
+        self.adapter = None
+        self.stop_event = None
+        self.wake_event = None
+        self.disconnected_event = None
+        self.smart_event = None
+        self.hold_until = 0.
+        self.force = False
+
+    def start_workers(self):
+        # SMART cache is refreshed by smart_task.
+        if self.mounts is not None:
+            self.mounts.start()
+        self.commands.start()
+        for broker in self.brokers:
+            broker.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.outbox is not None:
+            self.outbox.open()
+        if self.history is not None:
+            self.history.open()
+            self.start_history_worker()
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def restart_publish_timer(self, delay):
+        self.hold_until = self.loop.time() + delay
+        self.wake_event.set()
+
+    def dispatch_command(self, func, *args):
+        """Run command handler or response on the event loop and wait for it, so handler errors are raised
+        to the command executor."""
+        if threading.get_ident() == self.adapter.loop_thread:
+            # Response of a rejected command, sent from MQTT callback.
+            func(*args)
+        else:
+            asyncio.run_coroutine_threadsafe(self.run_handler(func, *args), self.loop).result()
+
+    async def run_handler(self, func, *args):
+        result = func(*args)
+        if asyncio.iscoroutine(result):
+            await result
+
+    def command_reboot(self):
+        return self.run_command('reboot')
+
+    def command_shutdown(self):
+        return self.run_command('shutdown', 'now', '-h')
+
+    def command_force_update(self):
+        self.force = True
+        self.hold_until = 0.
+        self.wake_event.set()
+
+    async def run_command(self, *args):
+        try:
+            process = await asyncio.create_subprocess_exec(*args)
+            await process.wait()
+        except OSError:
+            self.logger.error('Error {}'.format(args[0]))
+            raise
+
+    def refresh_smart(self):
+        self.loop.call_soon_threadsafe(self.smart_event.set)
+
+    def request_update(self, names):
+        self.loop.call_soon_threadsafe(super().request_update, names)
+
+    def request_reload(self, load):
+        # Applied by publish_task, not during an update.
+        self.reload_request = load
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wake_event.set)
+
+    async def apply_reload_async(self):
+        load, self.reload_request = self.reload_request, None
+        settings = await self.loop.run_in_executor(None, load)
+        if settings is not None:
+            self.reload_settings(settings)
+
+    def reconnect(self):
+        # connect_task connects to broker from settings after disconnect.
+        if self.connected:
+            self.mqtt_client.disconnect()
+
+    def flush_publish(self, info):
+        # Messages are queued in this loop iteration, write them now.
+        self.mqtt_client.loop_write()
+
+    def set_reconnect_delay(self):
+        # Reconnects are made by connect_task.
+        pass
+
+    def on_disconnect(self, client, userdata, rc):
+        super().on_disconnect(client, userdata, rc)
+        self.disconnected_event.set()
+
+    async def wait_stop(self, timeout):
+        """Sleep timeout seconds. Return True if stopped meanwhile."""
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def connect_task(self):
+        while self.is_run:
+            hostname = self.settings['mqtt']['hostname']
+            port = self.settings['mqtt']['port']
+            self.disconnected_event.clear()
+            try:
+                await self.loop.run_in_executor(None, self.mqtt_client.connect, hostname, port)
+            except Exception:
+                self.logger.debug('No connection to {}:{}'.format(hostname, port))
+                self.connection_attempt(False)
+                delay = self.backoff.next_delay()
+                self.logger.debug('Reconnect to {}:{} in {:.1f} seconds'.format(hostname, port, delay))
+                if await self.wait_stop(delay):
+                    return
+                continue
+            await self.disconnected_event.wait()
+            if await self.wait_stop(self.backoff.next_delay()):
+                return
+
+    async def publish_task(self):
+        while self.is_run:
+            if not self.connected and self.outbox is None:
+                timeout = None
+            else:
+                timeout = max(self.hold_until - self.loop.time(), self.scheduler.next_due())
+            try:
+                await asyncio.wait_for(self.wake_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wake_event.clear()
+            if self.reload_request is not None:
+                await self.apply_reload_async()
+            if self.loop.time() < self.hold_until:
+                continue
+            if self.force:
+                self.force = False
+                self.scheduler.reset()
+                self.delta.reset()
+            due = self.scheduler.pop_due()
+            if due:
+                await self.mqtt_update_sensors_async(due)
+                self.logger.debug('Updated sensors states to MQTT broker: {}'.format(', '.join(due)))
+
+    async def mqtt_update_sensors_async(self, names=None):
+        started = time.monotonic()
+        if self.update_disks_list():
+            if self.settings['homeassistant']:
+                self.mqtt_send_config()
+        payload, stale = await self.collectors.collect_async(names)
+        self.check_system_changed()
+        self.adapt_intervals(names, stale)
+        self.record_history(names, stale)
+        self.publish_state(payload, stale, names)
+        self.observe_cycle(started, names, stale)
+
+    async def smart_task(self):
+        try:
+            await asyncio.wait_for(self.smart_event.wait(), SMART_START_DELAY)
+        except asyncio.TimeoutError:
+            pass
+        self.smart_event.clear()
+        while self.is_run:
+            try:
+                if await self.smart.refresh_async():
+                    super().request_update(['devices'])
+            except Exception as e:
+                self.logger.error('Error refresh SMART cache: {}'.format(e))
+            try:
+                await asyncio.wait_for(self.smart_event.wait(), self.smart.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.smart_event.clear()
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.wake_event = asyncio.Event()
+        self.disconnected_event = asyncio.Event()
+        self.smart_event = asyncio.Event()
+        self.mqtt_client = self.create_mqtt_client()
+        self.adapter = AsyncioMqttAdapter(self.loop, self.mqtt_client)
+        self.logger.info('Connecting to MQTT broker on host {}:{}'.format(self.settings['mqtt']['hostname'],
+                                                                          self.settings['mqtt']['port']))
+        self.start_workers()
+        self.startup.mark('workers')
+        tasks = [self.loop.create_task(self.connect_task()),
+                 self.loop.create_task(self.publish_task())]
+        if self.smart is not None:
+            tasks.append(self.loop.create_task(self.smart_task()))
+        try:
+            await self.stop_event.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.mqtt_client.disconnect()
+            # Command handlers run on the loop, the executor thread is joined outside of it.
+            await self.loop.run_in_executor(None, self.commands.stop)
+            self.stop_workers()
+
+    def run(self):
+        self.is_run = True
+        asyncio.run(self.main())
+
+    def stop(self):
+        self.logger.info('Stopping')
+        self.is_run = False
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stop_event.set)
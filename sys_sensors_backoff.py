@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+
+
+class Backoff(object):
+    """Exponential backoff with jitter: n-th delay is random in [d / 2, d], d = min(maximum, initial * factor ** n).
+
+    Jitter spreads reconnects of many clients after a broker restart.
+    """
+
+    def __init__(self, initial=0.5, maximum=60., factor=2.):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        ceiling = min(self.maximum, self.initial * self.factor ** self.attempt)
+        if ceiling < self.maximum:
+            self.attempt += 1
+        return random.uniform(ceiling / 2., ceiling)
+
+    def reset(self):
+        self.attempt = 0
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark of sensors collection and publish path.
+
+Runs MainProcess against a fake smartctl, mocked psutil (configurable number of disks and SMART devices),
+fake sysfs temperature sensors and local fake MQTT broker. Reports per-collector latency, CPU time and allocated
+memory, SMART refresh time, discovery publish and end-to-end update cycle as the number of disks and devices grows.
+
+    python3 sys_sensors_benchmark.py --sizes 1,8,24,48 --cycles 20
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from unittest import mock
+
+import psutil
+
+from sys_sensors_fake_broker import FakeBroker
+from sys_sensors_mqtt import MainProcess
+from sys_sensors_settings import Settings
+import sys_sensors_thermal
+
+FAKE_SMARTCTL = '''#!{python}
+import json, os, sys
+count = int(os.environ.get('FAKE_SMARTCTL_DEVICES', '1'))
+args = sys.argv[1:]
+if '--scan' in args:
+    devices = ['/dev/sd' + (chr(97 + i // 26 - 1) if i >= 26 else '') + chr(97 + i % 26) for i in range(count)]
+    print(json.dumps({{'devices': [{{'name': device}} for device in devices]}}))
+else:
+    device = args[-1]
+    print(json.dumps({{'serial_number': 'SN-' + device[5:], 'model_name': 'Fake disk',
+                       'temperature': {{'current': 35}}, 'power_cycle_count': 100,
+                       'power_on_time': {{'hours': 10000}}}}))
+'''
+
+Partition = namedtuple('Partition', 'device mountpoint fstype opts')
+Usage = namedtuple('Usage', 'total used free percent')
+Memory = namedtuple('Memory', 'total available percent used free')
+# Fake sysfs: hwmon chip name -> temperatures (millidegrees), thermal zone type -> temperature.
+FAKE_HWMON = {'cpu_thermal': [45000], 'coretemp': [41000, 42000, 43000, 44000]}
+FAKE_THERMAL_ZONES = {'cpu-thermal': 45000, 'gpu-thermal': 40000}
+
+
+def fake_psutil(disks):
+    partitions = [Partition('/dev/fake{}'.format(i), '/mnt/disk{}'.format(i), 'ext4', 'rw') for i in range(disks)]
+    return [mock.patch.object(psutil, 'disk_partitions', return_value=partitions),
+            mock.patch.object(psutil, 'disk_usage', return_value=Usage(1 << 40, 1 << 39, 1 << 39, 50.)),
+            mock.patch.object(psutil, 'virtual_memory', return_value=Memory(1 << 29, 1 << 28, 50., 1 << 28, 1 << 28)),
+            mock.patch.object(psutil, 'boot_time', return_value=time.time() - 3600)]
+
+
+def fake_sysfs(directory):
+    """Write fake hwmon and thermal zone files, return patches of ThermalZones paths."""
+    for i, (name, temperatures) in enumerate(FAKE_HWMON.items()):
+        hwmon = os.path.join(directory, 'hwmon', 'hwmon{}'.format(i))
+        os.makedirs(hwmon)
+        with open(os.path.join(hwmon, 'name'), 'w') as f:
+            f.write(name + '\n')
+        for j, temperature in enumerate(temperatures, 1):
+            with open(os.path.join(hwmon, 'temp{}_input'.format(j)), 'w') as f:
+                f.write('{}\n'.format(temperature))
+    for i, (zone_type, temperature) in enumerate(FAKE_THERMAL_ZONES.items()):
+        zone = os.path.join(directory, 'thermal', 'thermal_zone{}'.format(i))
+        os.makedirs(zone)
+        for name, value in (('type', zone_type), ('temp', temperature)):
+            with open(os.path.join(zone, name), 'w') as f:
+                f.write('{}\n'.format(value))
+    return [mock.patch.object(sys_sensors_thermal, 'HWMON_GLOB', os.path.join(directory, 'hwmon', 'hwmon*')),
+            mock.patch.object(sys_sensors_thermal, 'THERMAL_ZONES_GLOB',
+                              os.path.join(directory, 'thermal', 'thermal_zone*'))]
+
+
+def measure(func, repeat, cpu_clock=time.thread_time):
+    """Return wall time (mean, max), CPU time (mean) and peak allocated bytes of func calls."""
+    wall = []
+    cpu = 0.
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        cpu_started = cpu_clock()
+        started = time.perf_counter()
+        func()
+        wall.append(time.perf_counter() - started)
+        cpu += cpu_clock() - cpu_started
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {'wall_ms': 1000. * sum(wall) / repeat, 'wall_max_ms': 1000. * max(wall),
+            'cpu_ms': 1000. * cpu / repeat, 'alloc_kb': peak / 1024.}
+
+
+def wait_received(broker, count, timeout=5.):
+    deadline = time.monotonic() + timeout
+    while broker.received < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def bench_size(size, cycles, broker, logger, sysfs):
+    os.environ['FAKE_SMARTCTL_DEVICES'] = str(size)
+    settings = Settings(logger)
+    settings.check_settings()
+    settings.settings['mqtt']['port'] = broker.port
+    settings.settings['homeassistant'] = True
+    settings.settings['client_id'] = 'benchmark_{}'.format(size)
+    patches = fake_psutil(size) + sysfs
+    for patch in patches:
+        patch.start()
+    try:
+        process = MainProcess(logger, settings.settings)
+        process.mqtt_client = process.create_mqtt_client()
+        # No publish timer and discovery verification in background.
+        process.mqtt_client.on_connect = None
+        process.mqtt_client.on_disconnect = None
+        process.mqtt_client.connect('127.0.0.1', broker.port)
+        process.mqtt_client.loop_start()
+        process.connected = True
+        results = {'smart_refresh': measure(process.smart.refresh, 1)}
+        process.update_disks_list()
+        process.discovery.confirmed = True
+        process.discovery._client = process.mqtt_client
+
+        def send_config():
+            process.discovery.published = {}
+            process.mqtt_send_config()
+        results['send_config'] = measure(send_config, 1)
+        for name, collector in process.collectors.collectors.items():
+            results['collector_{}'.format(name)] = measure(collector.func, cycles)
+        payload, _ = process.collectors.collect()
+        results['json_dumps'] = measure(lambda: json.dumps(payload), cycles)
+        received = broker.received
+        # Collectors run on pool threads: process CPU time (includes MQTT network thread and local broker).
+        results['cycle'] = measure(process.mqtt_update_sensors, cycles, time.process_time)
+        # State and force_update switch state per cycle.
+        wait_received(broker, received + 2 * cycles)
+        results['cycle']['messages'] = (broker.received - received) / cycles
+        results['cycle']['payload_bytes'] = len(json.dumps(payload))
+        process.collectors.stop()
+        process.mqtt_client.disconnect()
+        process.mqtt_client.loop_stop()
+    finally:
+        for patch in patches:
+            patch.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SysSensorsMQTT collection and publish benchmark')
+    parser.add_argument('--sizes', default='1,8,24', help='comma separated numbers of disks and SMART devices')
+    parser.add_argument('--cycles', type=int, default=20, help='repeats of each measurement')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    logger = logging.Logger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    directory = tempfile.mkdtemp(prefix='sys_sensors_benchmark')
+    smartctl = os.path.join(directory, 'smartctl')
+    with open(smartctl, 'w') as f:
+        f.write(FAKE_SMARTCTL.format(python=sys.executable))
+    os.chmod(smartctl, os.stat(smartctl).st_mode | stat.S_IEXEC)
+    os.environ['PATH'] = directory + os.pathsep + os.environ.get('PATH', '')
+
+    sysfs = fake_sysfs(os.path.join(directory, 'sys'))
+
+    broker = FakeBroker().start()
+    report = {}
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            report[size] = bench_size(size, args.cycles, broker, logger, sysfs)
+    finally:
+        broker.stop()
+        shutil.rmtree(directory)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for size, results in report.items():
+        print('Disks and SMART devices: {}'.format(size))
+        print('  {:<24}{:>10}{:>10}{:>10}{:>12}'.format('', 'wall ms', 'max ms', 'cpu ms', 'alloc KB'))
+        for name, result in results.items():
+            print('  {:<24}{wall_ms:>10.2f}{wall_max_ms:>10.2f}{cpu_ms:>10.2f}{alloc_kb:>12.1f}'.format(name,
+                                                                                                     **result))
+        print('  cycle: {messages:.0f} messages, state payload {payload_bytes} bytes'.format(**results['cycle']))
+
+
+if __name__ == "__main__":
+    main()
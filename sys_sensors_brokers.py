@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+
+import paho.mqtt.client as mqtt
+
+# Messages handed to paho at once (in flight or waiting for acknowledgement), the rest wait in the queue.
+MAX_INFLIGHT = 20
+
+
+class BrokerLink(object):
+    """Extra broker that receives a copy of published states.
+
+    The broker has its own paho client (and network thread) and a sender thread. Messages wait in a bounded
+    queue (the oldest are dropped when it is full) until the broker is connected and accepts them, so a slow
+    or unreachable broker does not delay the main broker or the other brokers. Topics are prefixed with
+    prefix.
+    """
+
+    def __init__(self, logger_obj, options, client_id, reconnect_min=0.5, reconnect_max=60.):
+        self.logger = logger_obj
+        self.hostname = options['hostname']
+        self.port = options['port']
+        self.qos = options['qos']
+        self.prefix = options['prefix']
+        self.size = options['queue']
+        self.name = '{}:{}'.format(self.hostname, self.port)
+        self.queue = collections.deque()
+        self.dropped = 0
+        # Number of codec keys sent to keys topics (cleared on connect, the broker may have lost them).
+        self.keys_sent = {}
+        self.connected = False
+        self._dropping = False
+        self._running = False
+        self._thread = None
+        self._condition = threading.Condition()
+        self.client = mqtt.Client(client_id=options['client_id'] or client_id)
+        if options['user']:
+            self.client.username_pw_set(options['user'], options['password'])
+        self.client.max_inflight_messages_set(MAX_INFLIGHT)
+        self.client.max_queued_messages_set(MAX_INFLIGHT)
+        self.client.reconnect_delay_set(reconnect_min, reconnect_max)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
+
+    def topic(self, topic):
+        return '{}/{}'.format(self.prefix, topic) if self.prefix else topic
+
+    def put(self, messages):
+        """Queue messages (topic, payload, retain)."""
+        with self._condition:
+            for topic, payload, retain in messages:
+                if len(self.queue) >= self.size:
+                    self.queue.popleft()
+                    self.dropped += 1
+                    if not self._dropping:
+                        self._dropping = True
+                        self.logger.warning('Queue of broker {} is full, dropping the oldest messages'.format(
+                            self.name))
+                self.queue.append((self.topic(topic), payload, retain))
+            self._condition.notify()
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.logger.info('Connected to broker {}'.format(self.name))
+            with self._condition:
+                self.keys_sent.clear()
+                self.connected = True
+                self._condition.notify()
+        else:
+            self.logger.error('Connection to broker {} refused ({})'.format(self.name, mqtt.connack_string(rc)))
+
+    def on_disconnect(self, client, userdata, rc):
+        self.logger.debug('Disconnected from broker {}. {}'.format(self.name, rc))
+        with self._condition:
+            self.connected = False
+
+    def on_publish(self, client, userdata, mid):
+        with self._condition:
+            self._condition.notify()
+
+    def _send(self):
+        while True:
+            with self._condition:
+                while self._running and not (self.connected and self.queue):
+                    self._condition.wait()
+                if not self._running:
+                    return
+                topic, payload, retain = self.queue.popleft()
+                if not self.queue:
+                    self._dropping = False
+            info = self.client.publish(topic=topic, payload=payload, qos=self.qos, retain=retain)
+            # QoS 1 and 2 messages are kept and resent by paho after reconnect.
+            if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE or (info.rc == mqtt.MQTT_ERR_NO_CONN and self.qos == 0):
+                # Too many messages in flight or not connected: put the message back and wait.
+                with self._condition:
+                    self.queue.appendleft((topic, payload, retain))
+                    self._condition.wait(1.)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._send, name='broker {}'.format(self.name), daemon=True)
+        self._thread.start()
+        self.client.connect_async(self.hostname, self.port)
+        self.client.loop_start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(5.)
+            self._thread = None
+        self.client.disconnect()
+        self.client.loop_stop()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import re
+import struct
+import zlib
+
+CODECS = ('json', 'cbor', 'msgpack')
+NUMBER = re.compile(r'-?\d+(\.\d+)?([eE][-+]?\d+)?')
+
+
+def typed(value):
+    """Return number for numeric string sensor values, value otherwise."""
+    if isinstance(value, str) and NUMBER.fullmatch(value):
+        if value.lstrip('-').isdigit():
+            return int(value)
+        return float(value)
+    if isinstance(value, list):
+        return [typed(item) for item in value]
+    return value
+
+
+def _cbor_head(major, value) -> bytes:
+    if value < 24:
+        return bytes([major << 5 | value])
+    if value < 0x100:
+        return struct.pack('>BB', major << 5 | 24, value)
+    if value < 0x10000:
+        return struct.pack('>BH', major << 5 | 25, value)
+    if value < 0x100000000:
+        return struct.pack('>BI', major << 5 | 26, value)
+    return struct.pack('>BQ', major << 5 | 27, value)
+
+
+def _cbor_encode(obj, out):
+    if obj is None:
+        out.append(b'\xf6')
+    elif obj is True:
+        out.append(b'\xf5')
+    elif obj is False:
+        out.append(b'\xf4')
+    elif isinstance(obj, int):
+        out.append(_cbor_head(0, obj) if obj >= 0 else _cbor_head(1, -1 - obj))
+    elif isinstance(obj, float):
+        single = struct.pack('>f', obj)
+        if struct.unpack('>f', single)[0] == obj:
+            out.append(b'\xfa' + single)
+        else:
+            out.append(b'\xfb' + struct.pack('>d', obj))
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        out.append(_cbor_head(3, len(data)))
+        out.append(data)
+    elif isinstance(obj, bytes):
+        out.append(_cbor_head(2, len(obj)))
+        out.append(obj)
+    elif isinstance(obj, (list, tuple)):
+        out.append(_cbor_head(4, len(obj)))
+        for item in obj:
+            _cbor_encode(item, out)
+    elif isinstance(obj, dict):
+        out.append(_cbor_head(5, len(obj)))
+        for key, value in obj.items():
+            _cbor_encode(key, out)
+            _cbor_encode(value, out)
+    else:
+        raise TypeError('Object of type {} is not CBOR serializable'.format(type(obj).__name__))
+
+
+def cbor_dumps(obj) -> bytes:
+    """Encode obj (None, bool, int, float, str, bytes, list, dict) to CBOR (RFC 8949)."""
+    out = []
+    _cbor_encode(obj, out)
+    return b''.join(out)
+
+
+class PayloadCodec(object):
+    """Encoder of state payloads.
+
+    json (default) keeps the payload as is (never compressed), for Home Assistant value templates. cbor and
+    msgpack send numeric values as numbers. Their encoded payloads of at least compress_min bytes are compressed
+    with zlib (compressed payload starts with 0x78, which is never the first byte of a CBOR/MessagePack map).
+    With dictionary, keys are replaced with their indexes in the keys list (see keys_payload); the list
+    only grows, so indexes stay valid.
+    """
+
+    def __init__(self, name='json', compress_min=0, dictionary=False):
+        self.name = name
+        self.compress_min = compress_min if name != 'json' else 0
+        self.dictionary = dictionary and name != 'json'
+        self.keys = []
+        self.index = {}
+        self.keys_changed = False
+        if name == 'cbor':
+            self._dumps = cbor_dumps
+        elif name == 'msgpack':
+            import msgpack
+            self._dumps = lambda obj: msgpack.packb(obj, use_bin_type=True)
+        else:
+            self._dumps = lambda obj: json.dumps(obj).encode('utf-8')
+
+    def _key(self, key):
+        if key not in self.index:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.keys_changed = True
+        return self.index[key]
+
+    def encode(self, payload: dict) -> bytes:
+        if self.name != 'json':
+            payload = {self._key(key) if self.dictionary else key: typed(value) for key, value in payload.items()}
+        data = self._dumps(payload)
+        if self.compress_min and len(data) >= self.compress_min:
+            data = zlib.compress(data)
+        return data
+
+    def encode_keys(self) -> bytes:
+        """Encoded keys list (key of index i is keys[i])."""
+        return self._dumps(self.keys)
+
+    def keys_payload(self) -> bytes:
+        """Encoded keys list, keys_changed is cleared."""
+        self.keys_changed = False
+        return self.encode_keys()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import threading
+import time
+
+
+class Collector(object):
+    """Sensors source. func returns dict of payload values (in asyncio mode func may be a coroutine function)."""
+
+    def __init__(self, name, func, timeout):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.future = None
+        self.last_result = {}
+        self.latency = None
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            return self.func()
+        finally:
+            self.latency = time.monotonic() - started
+
+    async def run_async(self):
+        started = time.monotonic()
+        try:
+            return await self.func()
+        finally:
+            self.latency = time.monotonic() - started
+
+
+class CollectorPool(object):
+    """Runs registered collectors concurrently on a bounded thread pool.
+
+    A collector that misses its timeout (or is still running since the previous cycle) is reported as stale
+    and its last result is used, so one hung source does not block the publish.
+    """
+
+    def __init__(self, logger_obj, max_workers=4):
+        self.logger = logger_obj
+        self.max_workers = max_workers
+        self.collectors = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def register(self, name, func, timeout):
+        self.collectors[name] = Collector(name, func, timeout)
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                                       thread_name_prefix='collector')
+
+    def stop(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _select(self, names, stale):
+        """Return collectors to run. Collectors still running since previous cycle are added to stale."""
+        selected = []
+        for collector in self.collectors.values():
+            if names is not None and collector.name not in names:
+                continue
+            if collector.future is not None and not collector.future.done():
+                self.logger.warning('Collector {} is still running'.format(collector.name))
+                stale.append(collector.name)
+                continue
+            selected.append(collector)
+        return selected
+
+    def _store_result(self, collector, get_result, stale):
+        try:
+            collector.last_result = get_result()
+        except concurrent.futures.TimeoutError:
+            self.logger.warning('Collector {} timeout ({} s)'.format(collector.name, collector.timeout))
+            stale.append(collector.name)
+        except Exception as e:
+            self.logger.error('Collector {} error: {}'.format(collector.name, e))
+            stale.append(collector.name)
+
+    def results(self, names=None, stale=()) -> dict:
+        """Return last values of collectors names (all if None) that are not stale."""
+        payload = {}
+        for collector in self.collectors.values():
+            if (names is None or collector.name in names) and collector.name not in stale:
+                payload.update(collector.last_result)
+        return payload
+
+    def _payload(self):
+        payload = {}
+        for collector in self.collectors.values():
+            payload.update(collector.last_result)
+        return payload
+
+    def collect(self, names=None):
+        """Run collectors (all or only names). Return payload with last values of all collectors
+        and list of stale collectors names."""
+        self.start()
+        stale = []
+        started = time.monotonic()
+        running = self._select(names, stale)
+        for collector in running:
+            collector.future = self._executor.submit(collector.run)
+        for collector in sorted(running, key=lambda c: c.timeout):
+            remaining = max(0., started + collector.timeout - time.monotonic())
+            self._store_result(collector, lambda: collector.future.result(timeout=remaining), stale)
+        return self._payload(), stale
+
+    async def collect_async(self, names=None):
+        """Awaitable collect. Coroutine collectors run on the event loop, others on the thread pool."""
+        import asyncio
+        self.start()
+        loop = asyncio.get_running_loop()
+        stale = []
+        started = loop.time()
+        running = self._select(names, stale)
+        for collector in running:
+            if asyncio.iscoroutinefunction(collector.func):
+                collector.future = asyncio.ensure_future(collector.run_async())
+            else:
+                collector.future = loop.run_in_executor(self._executor, collector.run)
+        for collector in sorted(running, key=lambda c: c.timeout):
+            await asyncio.wait([collector.future], timeout=max(0., started + collector.timeout - loop.time()))
+            self._store_result(collector, lambda: self._done_result(collector.future), stale)
+        return self._payload(), stale
+
+    @staticmethod
+    def _done_result(future):
+        if not future.done():
+            raise concurrent.futures.TimeoutError()
+        return future.result()
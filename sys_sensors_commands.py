@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+import threading
+import time
+
+
+class Command(object):
+    def __init__(self, name, func, min_interval=0., window=0.):
+        self.name = name
+        self.func = func
+        self.min_interval = min_interval
+        self.window = window
+        self.last = float('-inf')
+        # Number of requests merged into the queued run, None if the command is not queued.
+        self.pending = None
+
+
+class CommandExecutor(object):
+    """Runs commands received from MQTT on a worker thread, not on MQTT network thread.
+
+    A command is run at most once per its min_interval. Commands with a window are delayed by window
+    seconds (or until min_interval has passed) and requests received meanwhile are merged into one run,
+    other commands received too soon are rejected. At most size commands wait in the queue.
+    Every request is answered by respond(name, status, merged) with status done, error, merged,
+    rate_limited or busy. dispatch(func, *args) runs handlers and responses (called directly by default).
+    """
+
+    def __init__(self, logger_obj, respond, dispatch=None, size=10):
+        self.logger = logger_obj
+        self.respond = respond
+        self.dispatch = dispatch or (lambda func, *args: func(*args))
+        self.size = size
+        self.commands = {}
+        self._queue = []
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def register(self, name, func, min_interval=0., window=0.):
+        self.commands[name] = Command(name, func, min_interval, window)
+
+    def submit(self, name):
+        """Queue command (called from MQTT callbacks)."""
+        command = self.commands[name]
+        now = time.monotonic()
+        with self._condition:
+            if command.pending is not None:
+                command.pending += 1
+                status = 'merged'
+            elif not command.window and now < command.last + command.min_interval:
+                status = 'rate_limited'
+            elif len(self._queue) >= self.size:
+                status = 'busy'
+            else:
+                command.pending = 0
+                heapq.heappush(self._queue, (max(now + command.window, command.last + command.min_interval), name))
+                self._condition.notify()
+                return
+        self.logger.debug('Command {} {}'.format(name, status))
+        self.dispatch(self.respond, name, status, 0)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._queue or self._queue[0][0] > time.monotonic()):
+                    self._condition.wait(self._queue[0][0] - time.monotonic() if self._queue else None)
+                if not self._running:
+                    return
+                _, name = heapq.heappop(self._queue)
+                command = self.commands[name]
+                merged = command.pending
+                command.pending = None
+                command.last = time.monotonic()
+            status = 'done'
+            try:
+                self.dispatch(command.func)
+            except Exception as e:
+                self.logger.error('Error run command {}: {}'.format(name, e))
+                status = 'error'
+            self.dispatch(self.respond, name, status, merged)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='commands', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(5.)
+            self._thread = None
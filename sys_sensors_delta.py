@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DeltaFilter(object):
+    """Keeps last published value per sensor and drops values that did not move past the deadband.
+
+    Deadband of a sensor is max(abs, rel * |last value|); settings are taken from the longest matching
+    key prefix in deadbands, else defaults. Every keepalive seconds full snapshot passes the filter.
+    """
+
+    def __init__(self, keepalive, deadband_abs=0., deadband_rel=0., deadbands=None):
+        self.keepalive = keepalive
+        self.deadband_abs = deadband_abs
+        self.deadband_rel = deadband_rel
+        self.deadbands = deadbands or {}
+        self.last = {}
+        self.last_full = None
+
+    def reset(self):
+        """Next filter call returns full snapshot."""
+        self.last = {}
+        self.last_full = None
+
+    def deadband(self, key):
+        prefix = max((p for p in self.deadbands if key.startswith(p)), key=len, default=None)
+        band = self.deadbands.get(prefix, {})
+        return band.get('abs', self.deadband_abs), band.get('rel', self.deadband_rel)
+
+    def changed(self, key, value) -> bool:
+        if key not in self.last:
+            return True
+        last = self.last[key]
+        if value == last:
+            return False
+        new_value = _to_float(value)
+        last_value = _to_float(last)
+        if new_value is None or last_value is None:
+            return True
+        deadband_abs, deadband_rel = self.deadband(key)
+        return abs(new_value - last_value) > max(deadband_abs, deadband_rel * abs(last_value))
+
+    def full_due(self, now=None) -> bool:
+        """Return True if full snapshot should be published now (keepalive restarts)."""
+        if now is None:
+            now = time.monotonic()
+        if self.last_full is None or now - self.last_full >= self.keepalive:
+            self.last_full = now
+            return True
+        return False
+
+    def filter(self, payload: dict, now=None) -> dict:
+        """Return part of payload that should be published."""
+        if self.full_due(now):
+            self.last = dict(payload)
+            return dict(payload)
+        delta = {key: value for key, value in payload.items() if self.changed(key, value)}
+        self.last.update(delta)
+        return delta
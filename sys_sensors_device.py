@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import json
+import time
+
+from sys_sensors_codec import PayloadCodec
+from sys_sensors_collectors import CollectorPool
+from sys_sensors_delta import DeltaFilter
+from sys_sensors_discovery import DiscoveryRegistry
+from sys_sensors_plugins import Metric
+from sys_sensors_publish import PublishBatch
+from sys_sensors_scheduler import Scheduler
+
+
+class SensorsDevice(object):
+    """Sensors of one Home Assistant device: collectors and their schedule, state publish (layout, delta filter,
+    codec, extra brokers) and discovery configs.
+
+    It has no MQTT connection and no sensors sources of its own: MainProcess adds the connection, commands and
+    local collectors, AggregatorProcess publishes remote hosts with its client.
+    """
+
+    def __init__(self, logger_obj, settings_dict):
+        self.settings = settings_dict
+        self.logger = logger_obj
+        self.first_state = False
+        self.disks = []
+        self.devices = {}
+        self.mqtt_client = None
+        self.connected = False
+        self.collectors = CollectorPool(self.logger, self.settings['collectors']['workers'])
+        self.scheduler = Scheduler()
+        self.brokers = []
+        self.outbox = None
+        self.delta = None
+        self.codec = None
+        self.create_publish_filters()
+        self.identifier = None
+        self.state_topic = None
+        self.discovery = None
+        self.set_identity()
+
+    def set_identity(self):
+        self.identifier = self.settings['device_name'].replace(' ', '_').lower()
+        self.state_topic = '{}/{}/state'.format(self.settings['topic'], self.identifier)
+        self.discovery = DiscoveryRegistry(self.logger,
+                                           '{}/{}/discovery'.format(self.settings['topic'], self.identifier))
+
+    def create_publish_filters(self):
+        publish = self.settings['publish']
+        self.delta = DeltaFilter(publish['keepalive'], publish['deadband_abs'], publish['deadband_rel'],
+                                 publish['deadband'])
+        try:
+            self.codec = PayloadCodec(publish['codec'], publish['compress_min'], publish['key_dictionary'])
+        except ImportError:
+            self.logger.error('msgpack is not installed, state is published as JSON')
+            self.codec = PayloadCodec()
+        # New codec has a new keys dictionary, extra brokers get the keys again.
+        for broker in self.brokers:
+            broker.keys_sent.clear()
+
+    def utc_from_timestamp(self, timestamp: float) -> dt.datetime:
+        """Return a UTC time from a timestamp."""
+        return dt.datetime.fromtimestamp(timestamp, dt.timezone.utc)
+
+    def as_local(self, dattim: dt.datetime) -> dt.datetime:
+        """Convert a UTC datetime object to local time zone."""
+        if dattim.tzinfo == self.settings['timezone']:
+            return dattim
+        if dattim.tzinfo is None:
+            dattim = dattim.replace(tzinfo=dt.timezone.utc)
+        return dattim.astimezone(self.settings['timezone'])
+
+    def update_period(self):
+        """Shortest interval between state publishes, seconds."""
+        return min(self.scheduler.periods.values())
+
+    def expire_after(self):
+        """Home Assistant expire_after: state is published at least every update_period
+        (in delta mode and topics layout full state is published at least every keepalive)."""
+        expire_after = int(self.update_period()) + 120
+        if self.settings['publish']['mode'] == 'delta' or self.settings['publish']['layout'] == 'topics':
+            expire_after += int(self.settings['publish']['keepalive'])
+        return expire_after
+
+    def value_template(self, key):
+        if self.settings['publish']['mode'] == 'delta':
+            # Delta state may not contain the key, keep current state then.
+            return '{{{{ value_json.{0} if value_json.{0} is defined else this.state }}}}'.format(key)
+        return '{{{{ value_json.{} }}}}'.format(key)
+
+    def state_config(self, key):
+        """Discovery config entries that point sensor to its state in the publish layout."""
+        if self.settings['publish']['layout'] == 'topics':
+            return {'state_topic': '{}/{}'.format(self.state_topic, key),
+                    'json_attributes_topic': '{}/attributes'.format(self.state_topic)}
+        return {'state_topic': self.state_topic,
+                'value_template': self.value_template(key),
+                'json_attributes_topic': self.state_topic}
+
+    def publish_state(self, payload, stale, names=None):
+        """Publish state of the collectors names (None - all) that ran, payload has values of all
+        collectors."""
+        payload['stale'] = stale
+        if self.brokers:
+            self.fan_out(payload)
+        if not self.connected:
+            if self.outbox is not None:
+                payload['timestamp'] = self.as_local(self.utc_from_timestamp(time.time())).isoformat()
+                self.outbox.put('{}/replay'.format(self.state_topic), json.dumps(payload))
+            return
+        if self.settings['publish']['mode'] == 'delta' and not self.first_state:
+            payload = self.delta.filter(payload)
+        elif self.settings['publish']['layout'] == 'topics':
+            payload = self.updated_state(payload, names, stale)
+        messages = self.state_messages(payload)
+        with PublishBatch(self.mqtt_client, self.flush_publish) as batch:
+            if self.codec.keys_changed:
+                self.publish_keys(batch)
+            for topic, data in messages:
+                batch.publish(topic=topic, payload=data, qos=1, retain=False)
+            batch.publish(topic='{}/{}/force_update'.format(self.settings['topic'], self.identifier),
+                          payload=b'OFF')
+        self.state_published()
+
+    def state_published(self):
+        """Called after state is published."""
+
+    def updated_state(self, payload, names, stale):
+        """Topics layout: values of the collectors that ran, every sensor topic is a message of its own
+        (full state every keepalive seconds)."""
+        if self.delta.full_due() or names is None:
+            return payload
+        state = self.collectors.results(names, stale)
+        state['stale'] = payload['stale']
+        return state
+
+    def state_messages(self, payload) -> list:
+        """Return (topic, payload) of state messages in the publish layout."""
+        if self.settings['publish']['layout'] == 'topics':
+            return [('{}/attributes'.format(self.state_topic), json.dumps({'stale': value})) if key == 'stale'
+                    else ('{}/{}'.format(self.state_topic, key), str(value)) for key, value in payload.items()]
+        if payload:
+            return [(self.state_topic, self.codec.encode(payload))]
+        return []
+
+    def fan_out(self, payload):
+        """Queue full state (not delta filtered) to extra brokers."""
+        messages = [(topic, data, False) for topic, data in self.state_messages(payload)]
+        keys_topic = '{}/keys'.format(self.state_topic)
+        for broker in self.brokers:
+            if self.codec.dictionary and broker.keys_sent.get(keys_topic, 0) < len(self.codec.keys):
+                broker.keys_sent[keys_topic] = len(self.codec.keys)
+                broker.put([(keys_topic, self.codec.encode_keys(), True)])
+            broker.put(messages)
+
+    def publish_keys(self, client):
+        """Publish keys dictionary of the payload codec (retained)."""
+        client.publish(topic='{}/keys'.format(self.state_topic), payload=self.codec.keys_payload(), qos=1,
+                       retain=True)
+
+    def flush_publish(self, info):
+        """Wait until message info (and all messages queued before it) is written to the socket."""
+        try:
+            info.wait_for_publish(1.)
+        except (ValueError, RuntimeError):
+            pass
+
+    def read_soc_temperature(self):
+        """Return SOC temperature or None if there is no known sensor."""
+        return None
+
+    def get_temp(self):
+        self.logger.debug('Get SOC temperature')
+        temp = self.read_soc_temperature()
+        return str(temp) if temp is not None else '-1'
+
+    def devices_payload(self, records) -> dict:
+        """Return SMART values of devices from records (device name -> SmartRecord)."""
+        devices_payload = {}
+        for device_name in self.devices.keys():
+            record = records.get(device_name)
+            if record is None:
+                continue
+            device_name_ = device_name.replace(' ', '_').lower()
+            for key, value in record.as_payload().items():
+                devices_payload['{}_{}'.format(key, device_name_)] = value
+        return devices_payload
+
+    def sensors(self) -> list:
+        """Return Metric of disks, SMART devices, memory, last boot and SOC temperature sensors."""
+        sensors = [Metric('soc_temperature', 'SOC temperature', unit='°C', device_class='temperature')]
+        for disk in self.disks:
+            disk_ = disk.replace('/', '_')
+            disk_ = disk_.replace(':\\', '')
+            sensors.append(Metric('disk_use_{}'.format(disk_), 'Disk use {}'.format(disk_), unit='%',
+                                  icon='mdi:harddisk'))
+            sensors.append(Metric('disk_total_{}'.format(disk_), 'Disk total {}'.format(disk_), unit='MB',
+                                  icon='mdi:harddisk'))
+        for device_name in self.devices.keys():
+            device_name_ = device_name.replace(' ', '_').lower()
+            sensors.append(Metric('temperature_{}'.format(device_name_), '{} temperature'.format(device_name),
+                                  unit='°C', device_class='temperature'))
+            sensors.append(Metric('power_cycle_count_{}'.format(device_name_),
+                                  '{} Power Cycle Count'.format(device_name), unit='i'))
+            sensors.append(Metric('power_on_hours_{}'.format(device_name_), '{} Power On Hours'.format(device_name),
+                                  unit='h'))
+        sensors.append(Metric('memory_use', 'Memory use', unit='%', icon='mdi:memory'))
+        sensors.append(Metric('last_boot', 'Last boot', device_class='timestamp', icon='mdi:clock-start'))
+        return sensors
+
+    def agent_sensors(self) -> list:
+        """Return Metric of agent own metrics."""
+        sensors = [Metric('agent_cycle_time', 'Agent cycle time', unit='ms'),
+                   Metric('agent_rss', 'Agent memory', unit='MB', icon='mdi:memory'),
+                   Metric('agent_cpu_time', 'Agent CPU time', unit='s'),
+                   Metric('agent_published', 'Agent published messages', state_class='total_increasing'),
+                   Metric('agent_queue', 'Agent MQTT queue'),
+                   Metric('agent_connect_attempts', 'Agent connect attempts'),
+                   Metric('agent_disconnected_time', 'Agent disconnected time', unit='s')]
+        for name in self.collectors.collectors:
+            sensors.append(Metric('agent_latency_{}'.format(name), 'Agent {} latency'.format(name), unit='ms'))
+        return sensors
+
+    def mqtt_send_config(self):
+        entities = {}
+        device_payload = {'device': {
+            'identifiers': ['{}'.format(self.identifier)],
+            'name': '{}'.format(self.settings['device_name']),
+            'model': self.settings['model'],
+            'manufacturer': self.settings['manufacturer']
+        }
+        }
+        expire_after = self.expire_after()
+        sensors = [(metric, {}) for metric in self.sensors()]
+        if self.settings['metrics']['enabled']:
+            diagnostic = {'icon': 'mdi:chart-timeline-variant', 'entity_category': 'diagnostic'}
+            sensors.extend((metric, diagnostic) for metric in self.agent_sensors())
+        for metric, defaults in sensors:
+            payload = {'name': '{} {}'.format(self.settings['device_name'], metric.name),
+                       **self.state_config(metric.key),
+                       'unique_id': '{0}_sensor_{1}'.format(self.identifier, metric.key),
+                       'expire_after': expire_after,
+                       }
+            payload.update(defaults)
+            payload.update(metric.config())
+            payload.update(device_payload)
+            entities['homeassistant/sensor/{0}/{1}/config'.format(self.identifier, metric.key)] = payload
+        # Force update switch.
+        payload = {'name': '{} Force update'.format(self.settings['device_name']),
+                   'state_topic': '{}/{}/force_update'.format(self.settings['topic'], self.identifier),
+                   'command_topic': '{}/{}/force_update'.format(self.settings['topic'], self.identifier),
+                   'unique_id': '{}_force_update'.format(self.identifier)
+                   }
+        payload.update(device_payload)
+        entities['homeassistant/switch/{0}/force_update/config'.format(self.identifier)] = payload
+        if self.settings['reboot/shutdown']:
+            # Reboot switch.
+            payload = {'name': '{} Reboot'.format(self.settings['device_name']),
+                       'state_topic': '{}/{}/reboot'.format(self.settings['topic'], self.identifier),
+                       'command_topic': '{}/{}/reboot'.format(self.settings['topic'], self.identifier),
+                       'icon': 'mdi:restart',
+                       'unique_id': '{}_reboot'.format(self.identifier)
+                       }
+            payload.update(device_payload)
+            entities['homeassistant/switch/{0}/reboot/config'.format(self.identifier)] = payload
+            # Shutdown switch.
+            payload = {'name': '{} Shutdown'.format(self.settings['device_name']),
+                       'state_topic': '{}/{}/shutdown'.format(self.settings['topic'], self.identifier),
+                       'command_topic': '{}/{}/shutdown'.format(self.settings['topic'], self.identifier),
+                       'icon': 'mdi:power',
+                       'unique_id': '{}_shutdown'.format(self.identifier)
+                       }
+            payload.update(device_payload)
+            entities['homeassistant/switch/{0}/shutdown/config'.format(self.identifier)] = payload
+        self.discovery.update(entities)
+        self.discovery.publish()
+
+    def mqtt_send_switches_state(self):
+        self.mqtt_client.publish(topic='{}/{}/force_update'.format(self.settings['topic'], self.identifier),
+                                 payload='OFF', qos=1, retain=False)
+        if self.settings['reboot/shutdown']:
+            self.mqtt_client.publish(topic='{}/{}/reboot'.format(self.settings['topic'], self.identifier),
+                                     payload='OFF', qos=1, retain=False)
+            self.mqtt_client.publish(topic='{}/{}/shutdown'.format(self.settings['topic'], self.identifier),
+                                     payload='OFF', qos=1, retain=False)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import threading
+
+
+class DiscoveryRegistry(object):
+    """Home Assistant discovery configs, serialized once and published only when changed.
+
+    Fingerprint of all configs and list of their topics is kept retained on fingerprint_topic. After connect
+    the retained fingerprint is compared with the local one: configs are republished only if it differs
+    (or does not arrive in verify_timeout seconds), and topics that are not configured anymore are cleared.
+    """
+
+    def __init__(self, logger_obj, fingerprint_topic, verify_timeout=5.):
+        self.logger = logger_obj
+        self.fingerprint_topic = fingerprint_topic
+        self.verify_timeout = verify_timeout
+        self.entities = {}
+        self.published = {}
+        self.confirmed = False
+        self._fingerprint = None
+        self._client = None
+        self._timer = None
+        self._lock = threading.RLock()
+
+    def update(self, entities: dict):
+        """Set configs (config topic -> dict). Unchanged configs are not serialized again."""
+        with self._lock:
+            new_entities = {}
+            for topic, config in entities.items():
+                cached = self.entities.get(topic)
+                if cached is not None and cached[0] == config:
+                    new_entities[topic] = cached
+                else:
+                    new_entities[topic] = (config, json.dumps(config, sort_keys=True))
+            if new_entities.keys() != self.entities.keys() or any(
+                    new_entities[topic][1] != self.entities[topic][1] for topic in new_entities):
+                self._fingerprint = None
+            self.entities = new_entities
+
+    def fingerprint(self) -> str:
+        with self._lock:
+            if self._fingerprint is None:
+                sha = hashlib.sha1()
+                for topic in sorted(self.entities):
+                    sha.update(topic.encode('utf-8'))
+                    sha.update(self.entities[topic][1].encode('utf-8'))
+                self._fingerprint = sha.hexdigest()
+            return self._fingerprint
+
+    def connected(self, client):
+        """Start verification of retained configs after (re)connect."""
+        with self._lock:
+            self._client = client
+            self.confirmed = False
+            self.published = {}
+            client.subscribe(self.fingerprint_topic, qos=1)
+            self._timer = threading.Timer(self.verify_timeout, self.verify, args=(None,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def disconnected(self):
+        with self._lock:
+            self.confirmed = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def verify(self, retained):
+        """Compare retained fingerprint (bytes or None if not received) with local configs."""
+        with self._lock:
+            if self.confirmed or self._client is None:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._client.unsubscribe(self.fingerprint_topic)
+            try:
+                retained = json.loads(retained.decode('utf-8')) if retained else {}
+            except ValueError:
+                retained = {}
+            self.confirmed = True
+            if retained.get('fingerprint') == self.fingerprint():
+                self.logger.debug('Discovery configs on broker are up to date')
+                self.published = {topic: entity[1] for topic, entity in self.entities.items()}
+                return
+            # Content on broker unknown: publish all, clear topics that are not configured.
+            self.published = {topic: None for topic in retained.get('topics', [])}
+            self.publish()
+
+    def publish(self) -> int:
+        """Publish added, changed and removed configs. Return number of published messages."""
+        with self._lock:
+            if not self.confirmed or self._client is None:
+                return 0
+            count = 0
+            for topic in list(self.published):
+                if topic not in self.entities:
+                    self._client.publish(topic=topic, payload=b'', qos=1, retain=True)
+                    del self.published[topic]
+                    count += 1
+            for topic, (config, serialized) in self.entities.items():
+                if self.published.get(topic) != serialized:
+                    self._client.publish(topic=topic, payload=serialized, qos=1, retain=True)
+                    self.published[topic] = serialized
+                    count += 1
+            if count:
+                self._client.publish(topic=self.fingerprint_topic,
+                                     payload=json.dumps({'fingerprint': self.fingerprint(),
+                                                         'topics': sorted(self.entities)}),
+                                     qos=1, retain=True)
+                self.logger.debug('Published {} discovery configs'.format(count))
+            return count
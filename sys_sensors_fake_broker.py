@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import struct
+import sys
+import threading
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def topic_matches(topic_filter, topic):
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def _remaining_length(length):
+    data = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        data.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(data)
+
+
+def _publish_packet(topic, payload, retain=False):
+    topic = topic.encode('utf-8')
+    body = struct.pack('!H', len(topic)) + topic + payload
+    return bytes([PUBLISH << 4 | int(retain)]) + _remaining_length(len(body)) + body
+
+
+class FakeBroker(object):
+    """Minimal local MQTT 3.1.1 broker for benchmarks, simulations and tests.
+
+    Supports QoS 0/1/2 publish, retained messages, subscriptions with wildcards (delivered with QoS 0).
+    No authentication, no persistence, no keepalive enforcement.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, on_publish=None):
+        self.host = host
+        self.port = port
+        self.on_publish = on_publish
+        self.retained = {}
+        self.received = 0
+        self.received_bytes = 0
+        self.connections = 0
+        self._subscriptions = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='fake_broker', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._thread.join(5)
+
+    def drop_connections(self):
+        """Close all client connections (simulates broker restart)."""
+        def close():
+            for writer in list(self._subscriptions):
+                writer.close()
+        self._loop.call_soon_threadsafe(close)
+
+    def _run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def _route(self, topic, payload, retain):
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        packet = None
+        for writer, filters in list(self._subscriptions.items()):
+            if any(topic_matches(topic_filter, topic) for topic_filter in filters):
+                packet = packet or _publish_packet(topic, payload)
+                writer.write(packet)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._subscriptions[writer] = set()
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7f) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                data = await reader.readexactly(length)
+                packet_type = header >> 4
+                if packet_type == CONNECT:
+                    writer.write(bytes([CONNACK << 4, 2, 0, 0]))
+                elif packet_type == PUBLISH:
+                    qos = (header >> 1) & 3
+                    topic_length = struct.unpack('!H', data[:2])[0]
+                    topic = data[2:2 + topic_length].decode('utf-8')
+                    index = 2 + topic_length
+                    if qos:
+                        packet_id = data[index:index + 2]
+                        index += 2
+                    payload = data[index:]
+                    self.received += 1
+                    self.received_bytes += len(data) + 2
+                    self._route(topic, payload, header & 1)
+                    if qos == 1:
+                        writer.write(bytes([PUBACK << 4, 2]) + packet_id)
+                    elif qos == 2:
+                        writer.write(bytes([PUBREC << 4, 2]) + packet_id)
+                    if self.on_publish is not None:
+                        self.on_publish(topic, payload)
+                elif packet_type == PUBREL:
+                    writer.write(bytes([PUBCOMP << 4, 2]) + data[:2])
+                elif packet_type == SUBSCRIBE:
+                    index = 2
+                    granted = bytearray()
+                    while index < len(data):
+                        topic_length = struct.unpack('!H', data[index:index + 2])[0]
+                        topic_filter = data[index + 2:index + 2 + topic_length].decode('utf-8')
+                        granted.append(min(data[index + 2 + topic_length], 1))
+                        index += 3 + topic_length
+                        self._subscriptions[writer].add(topic_filter)
+                    writer.write(bytes([SUBACK << 4]) + _remaining_length(2 + len(granted)) + data[:2] + granted)
+                    for topic, payload in list(self.retained.items()):
+                        if any(topic_matches(topic_filter, topic) for topic_filter in self._subscriptions[writer]):
+                            writer.write(_publish_packet(topic, payload, True))
+                elif packet_type == UNSUBSCRIBE:
+                    index = 2
+                    while index < len(data):
+                        topic_length = struct.unpack('!H', data[index:index + 2])[0]
+                        self._subscriptions[writer].discard(data[index + 2:index + 2 + topic_length].decode('utf-8'))
+                        index += 2 + topic_length
+                    writer.write(bytes([UNSUBACK << 4, 2]) + data[:2])
+                elif packet_type == PINGREQ:
+                    writer.write(bytes([PINGRESP << 4, 0]))
+                elif packet_type == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._subscriptions.pop(writer, None)
+            writer.close()
+
+
+if __name__ == "__main__":
+    broker = FakeBroker(port=int(sys.argv[1]) if len(sys.argv) > 1 else 1883).start()
+    print('Fake MQTT broker on {}:{}'.format(broker.host, broker.port))
+    try:
+        broker._thread.join()
+    except KeyboardInterrupt:
+        broker.stop()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Fleet simulation: load test of the MQTT broker and Home Assistant.
+
+Runs N virtual devices (AsyncMainProcess with its own identifier, fake disks and SMART devices and synthetic
+sensor values instead of local sensors) on one event loop against local fake MQTT broker (or a broker given by --broker), optionally drops
+all connections every --storm seconds (reconnect storm, local broker only). Reports publish throughput, state
+latency percentiles (from publish to broker, with --broker - to a subscriber of state topics) and reconnect times.
+
+    python3 sys_sensors_fleet.py --devices 2000 --interval 30 --duration 300 --storm 60
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import random
+import resource
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from sys_sensors_fake_broker import FakeBroker
+from sys_sensors_async import AsyncMainProcess
+from sys_sensors_settings import Settings
+
+
+class RandomWalk(object):
+    """Synthetic sensor value: random walk within [low, high]."""
+
+    def __init__(self, low, high, step):
+        self.low = low
+        self.high = high
+        self.step = step
+        self.value = random.uniform(low, high)
+
+    def next(self) -> str:
+        self.value = min(self.high, max(self.low, self.value + random.uniform(-self.step, self.step)))
+        return '{0:.1f}'.format(self.value)
+
+
+class FleetStats(object):
+    """Sent states (by topic and payload) and their latencies, connection events.
+
+    States not received in max_age seconds are forgotten (their latency is not measured).
+    """
+
+    def __init__(self, max_age=10.):
+        self.max_age = max_age
+        self.sent = {}
+        self.latencies = []
+        self.states_sent = 0
+        self.states_received = 0
+        self.connects = 0
+        self.disconnects = 0
+        self._lock = threading.Lock()
+
+    def connection_changed(self, connected):
+        with self._lock:
+            if connected:
+                self.connects += 1
+            else:
+                self.disconnects += 1
+
+    def state_sent(self, topic, data):
+        with self._lock:
+            self.sent[(topic, data)] = time.monotonic()
+            self.states_sent += 1
+
+    def state_received(self, topic, payload):
+        with self._lock:
+            sent = self.sent.pop((topic, bytes(payload)), None)
+            if sent is not None:
+                self.latencies.append(time.monotonic() - sent)
+                self.states_received += 1
+
+    def take_latencies(self) -> list:
+        """Return latencies measured since the last call, forget states older than max_age."""
+        oldest = time.monotonic() - self.max_age
+        with self._lock:
+            latencies, self.latencies = self.latencies, []
+            self.sent = {key: sent for key, sent in self.sent.items() if sent >= oldest}
+        return latencies
+
+
+def percentiles(values, points=(50, 90, 99)) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {'p{}'.format(point): 1000. * values[min(len(values) - 1, len(values) * point // 100)]
+              for point in points}
+    result['max'] = 1000. * values[-1]
+    return result
+
+
+class VirtualDevice(AsyncMainProcess):
+    """AsyncMainProcess with fake disks and SMART devices and synthetic sensor values.
+
+    Devices run on one event loop (paho select loop threads are limited to 1024 file descriptors): collectors
+    are coroutines, local sources (SMART, mounts, sysfs, system statistics, plugins and sampling) are not created.
+    """
+
+    def __init__(self, logger_obj, settings_dict, stats, disks=2, devices=2):
+        self.stats = stats
+        self.fake_disks = ['/mnt/disk{}'.format(i) for i in range(disks)]
+        self.fake_devices = ['fake_{}'.format(i) for i in range(devices)]
+        super().__init__(logger_obj, settings_dict)
+
+    def register_collectors(self):
+        self.memory = RandomWalk(20., 90., 2.)
+        self.soc = RandomWalk(40., 75., 1.)
+        self.disk_use = [RandomWalk(10., 95., 0.1) for _ in self.fake_disks]
+        self.device_temperature = [RandomWalk(30., 55., 0.5) for _ in self.fake_devices]
+        self.power_on_hours = [random.randint(100, 50000) for _ in self.fake_devices]
+        self.boot_time = time.time() - random.uniform(3600., 30 * 86400.)
+        timeouts = self.settings['collectors']['timeout']
+        for name, func in (('memory', self.collect_memory), ('last_boot', self.collect_last_boot),
+                           ('disks', self.collect_disks), ('devices', self.collect_devices),
+                           ('temperature', self.collect_temperature)):
+            self.collectors.register(name, func, timeouts[name])
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.stats.connection_changed(True)
+        super().on_connect(client, userdata, flags, rc)
+
+    def on_disconnect(self, client, userdata, rc):
+        if self.connected:
+            self.stats.connection_changed(False)
+        super().on_disconnect(client, userdata, rc)
+
+    def state_messages(self, payload) -> list:
+        messages = super().state_messages(payload)
+        for topic, data in messages:
+            self.stats.state_sent(topic, data if isinstance(data, bytes) else data.encode('utf-8'))
+        return messages
+
+    def update_disks_list(self):
+        devices = dict.fromkeys(self.fake_devices)
+        update_config = set(self.fake_disks) != set(self.disks) or devices.keys() != self.devices.keys()
+        self.disks = list(self.fake_disks)
+        self.devices = devices
+        return update_config
+
+    async def collect_memory(self):
+        return {'memory_use': self.memory.next()}
+
+    async def collect_last_boot(self):
+        return {'last_boot': str(self.as_local(self.utc_from_timestamp(self.boot_time)).isoformat())}
+
+    async def collect_temperature(self):
+        return {'soc_temperature': self.soc.next()}
+
+    async def collect_disks(self):
+        payload = {}
+        for disk, use in zip(self.fake_disks, self.disk_use):
+            disk_ = disk.replace('/', '_')
+            payload['disk_use_{}'.format(disk_)] = use.next()
+            payload['disk_total_{}'.format(disk_)] = '953869.7'
+        return payload
+
+    async def collect_devices(self):
+        payload = {}
+        for device_name, temperature, hours in zip(self.fake_devices, self.device_temperature,
+                                                   self.power_on_hours):
+            payload['temperature_{}'.format(device_name)] = temperature.next()
+            payload['power_cycle_count_{}'.format(device_name)] = '100'
+            payload['power_on_hours_{}'.format(device_name)] = str(hours)
+        return payload
+
+
+async def run_devices(devices, ramp):
+    """Start devices evenly within ramp seconds, return when all are stopped."""
+    tasks = []
+    for device in devices:
+        if device.is_run:
+            tasks.append(asyncio.ensure_future(device.main()))
+            await asyncio.sleep(ramp / len(devices))
+    await asyncio.gather(*tasks)
+    # Connects still running when devices stopped end in executor threads, close their connections.
+    await asyncio.get_running_loop().shutdown_default_executor()
+    for device in devices:
+        device.mqtt_client.disconnect()
+    await asyncio.sleep(0.5)
+
+
+def device_settings(base, index, args) -> dict:
+    settings = copy.deepcopy(base)
+    settings['device_name'] = 'fleet {:05d}'.format(index)
+    settings['client_id'] = 'fleet_{:05d}'.format(index)
+    settings['update_interval'] = args.interval
+    settings['intervals'] = {name: args.interval for name in settings['intervals']}
+    settings['homeassistant'] = not args.no_discovery
+    settings['publish']['mode'] = 'full'
+    settings['publish']['layout'] = 'json'
+    settings['mqtt']['reconnect_min'] = args.reconnect_min
+    settings['mqtt']['reconnect_max'] = args.reconnect_max
+    settings['collectors']['workers'] = 1
+    settings['reboot/shutdown'] = False
+    for section, key, value in (('outbox', 'enabled', False), ('history', 'enabled', False),
+                                ('adaptive', 'enabled', False), ('metrics', 'enabled', False),
+                                ('metrics', 'prometheus_port', 0)):
+        settings[section] = dict(settings[section], **{key: value})
+    settings['brokers'] = []
+    return settings
+
+
+def report_line(elapsed, stats, broker_messages, broker_bytes, period, latencies, connected, devices):
+    line = '{:7.1f} s  connected {}/{}  {:8.1f} msg/s {:8.1f} KB/s  states {}/{}'.format(
+        elapsed, connected, devices, broker_messages / period, broker_bytes / period / 1024.,
+        stats.states_received, stats.states_sent)
+    latency = percentiles(latencies)
+    if latency:
+        line += '  latency ms p50 {p50:.1f} p90 {p90:.1f} p99 {p99:.1f} max {max:.1f}'.format(**latency)
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SysSensorsMQTT fleet simulation')
+    parser.add_argument('--devices', type=int, default=100, help='number of virtual devices')
+    parser.add_argument('--disks', type=int, default=2, help='fake disks per device')
+    parser.add_argument('--smart', type=int, default=2, help='fake SMART devices per device')
+    parser.add_argument('--interval', type=int, default=30, help='update interval of all sensors, seconds')
+    parser.add_argument('--duration', type=float, default=120., help='simulation time, seconds')
+    parser.add_argument('--ramp', type=float, default=10., help='devices are started within ramp seconds')
+    parser.add_argument('--storm', type=float, default=0., help='drop all connections every storm seconds')
+    parser.add_argument('--reconnect-min', type=float, default=0.5, help='minimum reconnect delay, seconds')
+    parser.add_argument('--reconnect-max', type=float, default=60., help='maximum reconnect delay, seconds')
+    parser.add_argument('--no-discovery', action='store_true', help='do not publish discovery configs')
+    parser.add_argument('--broker', help='host:port of the broker to test (default - local fake broker)')
+    parser.add_argument('--report', type=float, default=10., help='report interval, seconds')
+    parser.add_argument('--stack-kb', type=int, default=256, help='thread stack size, KB')
+    parser.add_argument('--json', action='store_true', help='print summary as JSON')
+    args = parser.parse_args()
+
+    logger = logging.Logger('fleet')
+    logger.addHandler(logging.NullHandler())
+    # Every device has a command executor thread and a socket (two with the local broker).
+    threading.stack_size(args.stack_kb * 1024)
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    stats = FleetStats(args.report)
+    broker = None
+    monitor = None
+    base = Settings(logger)
+    base.check_settings()
+    base = base.settings
+    if args.broker:
+        host, _, port = args.broker.rpartition(':')
+        base['mqtt']['hostname'], base['mqtt']['port'] = host, int(port)
+        counters = {'received': 0, 'bytes': 0}
+
+        def on_message(client, userdata, message):
+            counters['received'] += 1
+            counters['bytes'] += len(message.payload)
+            stats.state_received(message.topic, message.payload)
+        monitor = mqtt.Client(client_id='fleet_monitor')
+        monitor.on_message = on_message
+        monitor.connect(host, int(port))
+        monitor.subscribe('{}/+/state'.format(base['topic']))
+        monitor.loop_start()
+        received = lambda: (counters['received'], counters['bytes'])
+    else:
+        broker = FakeBroker(on_publish=stats.state_received).start()
+        base['mqtt']['hostname'], base['mqtt']['port'] = broker.host, broker.port
+        received = lambda: (broker.received, broker.received_bytes)
+
+    devices = [VirtualDevice(logger, device_settings(base, i, args), stats, args.disks, args.smart)
+               for i in range(args.devices)]
+    for device in devices:
+        device.is_run = True
+    started = time.monotonic()
+    runner = threading.Thread(target=asyncio.run, args=(run_devices(devices, args.ramp),), name='devices')
+    runner.start()
+
+    storms = []
+    storm_due = started + args.storm if args.storm and broker is not None else float('inf')
+    storm_started = None
+    report_due = started + args.report
+    last = received()
+    last_time = started
+    all_latencies = []
+    try:
+        while time.monotonic() - started < args.duration:
+            time.sleep(0.1)
+            now = time.monotonic()
+            connected = sum(device.connected for device in devices)
+            if storm_started is not None and connected == len(devices):
+                storms.append(now - storm_started)
+                if not args.json:
+                    print('reconnect storm: all devices reconnected in {:.1f} s'.format(now - storm_started))
+                storm_started = None
+            if now >= storm_due:
+                storm_due = now + args.storm
+                storm_started = now
+                broker.drop_connections()
+            if now >= report_due:
+                report_due = now + args.report
+                current = received()
+                latencies = stats.take_latencies()
+                all_latencies.extend(latencies)
+                if not args.json:
+                    print(report_line(now - started, stats, current[0] - last[0], current[1] - last[1],
+                                      now - last_time, latencies, connected, len(devices)))
+                last, last_time = current, now
+    finally:
+        for device in devices:
+            device.stop()
+        runner.join()
+        if monitor is not None:
+            monitor.loop_stop()
+            monitor.disconnect()
+        if broker is not None:
+            broker.stop()
+
+    all_latencies.extend(stats.take_latencies())
+    total = received()
+    elapsed = time.monotonic() - started
+    summary = {'devices': args.devices, 'duration_s': elapsed, 'messages': total[0],
+               'messages_per_s': total[0] / elapsed, 'bytes_per_s': total[1] / elapsed,
+               'states_sent': stats.states_sent, 'states_received': stats.states_received,
+               'latency_ms': percentiles(all_latencies), 'connects': stats.connects,
+               'disconnects': stats.disconnects, 'storm_reconnect_s': storms}
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print('{devices} devices, {duration_s:.0f} s: {messages} messages ({messages_per_s:.1f}/s, '
+          '{:.1f} KB/s), states received {states_received}/{states_sent}, connects {connects}, '
+          'disconnects {disconnects}'.format(summary['bytes_per_s'] / 1024., **summary))
+    if summary['latency_ms']:
+        print('state latency ms: ' + ', '.join('{} {:.1f}'.format(key, value)
+                                               for key, value in summary['latency_ms'].items()))
+    if storms:
+        print('reconnect storms: ' + ', '.join('{:.1f} s'.format(storm) for storm in storms))
+
+
+if __name__ == "__main__":
+    main()
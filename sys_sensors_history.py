@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from sys_sensors_codec import typed
+
+MAGIC = b'SSH1'
+# Magic, capacity (records), number of keys, number of records written.
+HEADER = struct.Struct('<4sIIQ')
+HEADER_SIZE = 64
+# Key names separated by newlines.
+KEYS_SIZE = 16384
+# Timestamp, key index, value.
+RECORD = struct.Struct('<dHd')
+RECORDS_OFFSET = HEADER_SIZE + KEYS_SIZE
+
+
+class History(object):
+    """Fixed-size ring buffer of numeric sensor values in a memory-mapped file.
+
+    Every value is one record (timestamp, key index, value); when the buffer is full the oldest records
+    are overwritten. The file is kept between restarts (recreated if its capacity changes).
+    """
+
+    def __init__(self, logger_obj, path, capacity=100000):
+        self.logger = logger_obj
+        self.path = path
+        self.capacity = capacity
+        self.keys = []
+        self.index = {}
+        self.written = 0
+        self._keys_size = 0
+        self._fd = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        with self._lock:
+            if self._map is not None:
+                return
+            size = RECORDS_OFFSET + self.capacity * RECORD.size
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            header = os.pread(self._fd, HEADER.size, 0)
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                header = b''
+            self._map = mmap.mmap(self._fd, size)
+            if len(header) == HEADER.size and header[:4] == MAGIC:
+                _, _, count, self.written = HEADER.unpack(header)
+                names = bytes(self._map[HEADER_SIZE:HEADER_SIZE + KEYS_SIZE]).rstrip(b'\0')
+                self.keys = names.decode('utf-8').split('\n')[:count] if count else []
+                self._keys_size = len(names)
+                self.index = {key: i for i, key in enumerate(self.keys)}
+            else:
+                self._map[:RECORDS_OFFSET] = bytes(RECORDS_OFFSET)
+                self._write_header()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+                self._map.close()
+                self._map = None
+                os.close(self._fd)
+                self._fd = None
+
+    def _write_header(self):
+        self._map[:HEADER.size] = HEADER.pack(MAGIC, self.capacity, len(self.keys), self.written)
+
+    def _key(self, key):
+        i = self.index.get(key)
+        if i is None:
+            name = key.encode('utf-8') + b'\n'
+            if self._keys_size + len(name) > KEYS_SIZE:
+                return None
+            offset = HEADER_SIZE + self._keys_size
+            self._map[offset:offset + len(name)] = name
+            self._keys_size += len(name)
+            i = self.index[key] = len(self.keys)
+            self.keys.append(key)
+        return i
+
+    def append(self, payload: dict, ts=None):
+        """Store numeric values of payload."""
+        if ts is None:
+            ts = time.time()
+        with self._lock:
+            if self._map is None:
+                return
+            for key, value in payload.items():
+                value = typed(value)
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                i = self._key(key)
+                if i is None:
+                    continue
+                RECORD.pack_into(self._map, RECORDS_OFFSET + (self.written % self.capacity) * RECORD.size,
+                                 ts, i, value)
+                self.written += 1
+            self._write_header()
+
+    def query(self, keys=None, start=None, end=None, step=0., max_points=1000) -> dict:
+        """Return {key: points} of values with start <= timestamp <= end. With step, values are averaged
+        in step seconds buckets, point is [bucket start, mean, min, max], otherwise [timestamp, value].
+        At most max_points last points of each key are returned."""
+        with self._lock:
+            if self._map is None:
+                return {}
+            records = bytes(self._map[RECORDS_OFFSET:RECORDS_OFFSET + min(self.written, self.capacity) *
+                                      RECORD.size])
+            names = list(self.keys)
+        wanted = None if keys is None else {self.index[key] for key in keys if key in self.index}
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        series = {}
+        for ts, i, value in RECORD.iter_unpack(records):
+            if start <= ts <= end and (wanted is None or i in wanted):
+                if step > 0:
+                    bucket = series.setdefault(i, {}).setdefault(ts // step * step, [0., 0, value, value])
+                    bucket[0] += value
+                    bucket[1] += 1
+                    bucket[2] = min(bucket[2], value)
+                    bucket[3] = max(bucket[3], value)
+                else:
+                    series.setdefault(i, []).append([ts, value])
+        result = {}
+        for i, points in series.items():
+            if step > 0:
+                points = [[ts, total / count, low, high] for ts, (total, count, low, high) in points.items()]
+            points.sort()
+            result[names[i]] = points[-max_points:]
+        return result
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import psutil
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+class Histogram(object):
+    """Cumulative histogram with fixed buckets (seconds), as in Prometheus."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def prometheus_lines(self, name, labels=''):
+        lines = []
+        separator = ',' if labels else ''
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(name, labels, separator, bound, count))
+        lines.append('{}_bucket{{{}{}le="+Inf"}} {}'.format(name, labels, separator, self.count))
+        labels = '{{{}}}'.format(labels) if labels else ''
+        lines.append('{}_sum{} {}'.format(name, labels, self.sum))
+        lines.append('{}_count{} {}'.format(name, labels, self.count))
+        return lines
+
+
+class SelfMetrics(object):
+    """Performance metrics of the daemon itself."""
+
+    def __init__(self):
+        self.process = psutil.Process()
+        self.cycle = Histogram()
+        self.last_cycle = 0.
+        self.collectors = {}
+        self.last_latency = {}
+        self.stale = {}
+        self.published = 0
+        self._lock = threading.Lock()
+
+    def observe_cycle(self, duration, collectors, stale):
+        """Record update cycle duration and latency of collectors (Collector objects) that ran in it."""
+        with self._lock:
+            self.cycle.observe(duration)
+            self.last_cycle = duration
+            for collector in collectors:
+                if collector.name in stale:
+                    self.stale[collector.name] = self.stale.get(collector.name, 0) + 1
+                elif collector.latency is not None:
+                    self.collectors.setdefault(collector.name, Histogram()).observe(collector.latency)
+                    self.last_latency[collector.name] = collector.latency
+
+    def on_publish(self, client, userdata, mid):
+        with self._lock:
+            self.published += 1
+
+    def process_stats(self):
+        """Return RSS (bytes) and CPU time (seconds) of the daemon."""
+        with self.process.oneshot():
+            cpu_times = self.process.cpu_times()
+            return self.process.memory_info().rss, cpu_times.user + cpu_times.system
+
+    def prometheus_text(self, gauges):
+        """Return metrics in Prometheus text format. gauges: name -> (type, value), added as is."""
+        rss, cpu_time = self.process_stats()
+        lines = ['# TYPE sys_sensors_rss_bytes gauge',
+                 'sys_sensors_rss_bytes {}'.format(rss),
+                 '# TYPE sys_sensors_cpu_seconds_total counter',
+                 'sys_sensors_cpu_seconds_total {}'.format(cpu_time)]
+        with self._lock:
+            lines.append('# TYPE sys_sensors_published_total counter')
+            lines.append('sys_sensors_published_total {}'.format(self.published))
+            lines.append('# TYPE sys_sensors_cycle_seconds histogram')
+            lines.extend(self.cycle.prometheus_lines('sys_sensors_cycle_seconds'))
+            lines.append('# TYPE sys_sensors_collector_seconds histogram')
+            for name, histogram in sorted(self.collectors.items()):
+                lines.extend(histogram.prometheus_lines('sys_sensors_collector_seconds',
+                                                        'collector="{}"'.format(name)))
+            lines.append('# TYPE sys_sensors_collector_stale_total counter')
+            for name, count in sorted(self.stale.items()):
+                lines.append('sys_sensors_collector_stale_total{{collector="{}"}} {}'.format(name, count))
+        for name, (metric_type, value) in gauges.items():
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+class StartupTimer(object):
+    """Startup steps times, seconds since process start (interpreter start and imports included)."""
+
+    def __init__(self):
+        self.started = psutil.Process().create_time()
+        self.steps = []
+
+    def mark(self, step):
+        self.steps.append((step, time.time() - self.started))
+
+    def report(self) -> str:
+        return ', '.join('{} {:.2f} s'.format(step, elapsed) for step, elapsed in self.steps)
+
+
+class MetricsServer(object):
+    """HTTP server with metrics in Prometheus text format on /metrics. text_func returns the text."""
+
+    def __init__(self, logger_obj, host, port, text_func):
+        self.logger = logger_obj
+        self.host = host
+        self.port = port
+        self.text_func = text_func
+        self._server = None
+
+    def start(self):
+        if self._server is not None:
+            return
+        # Imported only when the endpoint is enabled, http.server is slow to import.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        text_func = self.text_func
+        logger = self.logger
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                try:
+                    body = text_func().encode('utf-8')
+                except Exception as e:
+                    logger.error('Error prepare metrics: {}'.format(e))
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            self.logger.error('Error start metrics server on {}:{}: {}'.format(self.host, self.port, e))
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+        self.logger.info('Metrics server on http://{}:{}/metrics'.format(self.host, self.port))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
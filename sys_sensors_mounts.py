@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import select
+import socket
+import threading
+
+import psutil
+
+NETLINK_KOBJECT_UEVENT = 15
+# Kernel uevents multicast group (udev rebroadcasts to group 2).
+UEVENT_KERNEL_GROUP = 1
+
+
+def parse_uevent(data: bytes) -> dict:
+    """Parse kernel uevent message ("action@devpath\\0KEY=VALUE\\0...") to dict of KEY: VALUE."""
+    event = {}
+    for field in data.split(b'\0')[1:]:
+        key, separator, value = field.partition(b'=')
+        if separator:
+            event[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'replace')
+    return event
+
+
+class MountWatcher(object):
+    """In-memory index of mounted partitions (psutil.disk_partitions), updated on changes only.
+
+    Mount table changes are signalled by poll() on /proc/self/mountinfo (POLLPRI), block devices being added
+    or removed by kernel uevents on netlink socket. Where neither is available (not Linux), the index is
+    rebuilt on every get_partitions call.
+
+    on_mounts_change(added, removed) gets lists of mountpoints, on_block_change(action, devname) is called for
+    whole disks 'add' and 'remove' uevents. Both are called from the watcher thread.
+    """
+
+    def __init__(self, logger_obj, on_mounts_change=None, on_block_change=None, mountinfo='/proc/self/mountinfo'):
+        self.logger = logger_obj
+        self.on_mounts_change = on_mounts_change
+        self.on_block_change = on_block_change
+        self.mountinfo = mountinfo
+        self.partitions = {}
+        self.watching = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake_fds = None
+
+    def refresh(self):
+        """Rebuild index. Return lists of added and removed mountpoints."""
+        partitions = {partition.mountpoint: partition for partition in psutil.disk_partitions()}
+        with self._lock:
+            added = [mountpoint for mountpoint in partitions if mountpoint not in self.partitions]
+            removed = [mountpoint for mountpoint in self.partitions if mountpoint not in partitions]
+            for mountpoint in removed:
+                del self.partitions[mountpoint]
+            for mountpoint in added:
+                self.partitions[mountpoint] = partitions[mountpoint]
+        return added, removed
+
+    def get_partitions(self) -> list:
+        if not self.watching:
+            self.refresh()
+        with self._lock:
+            return list(self.partitions.values())
+
+    def _open_uevent_socket(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, UEVENT_KERNEL_GROUP))
+        except (AttributeError, OSError) as e:
+            self.logger.debug('Block devices uevents are not available: {}'.format(e))
+            return None
+        return sock
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.refresh()
+        try:
+            mountinfo = open(self.mountinfo, 'rb')
+        except OSError as e:
+            self.logger.debug('Mount table changes are not watched: {}'.format(e))
+            return
+        poller = select.poll()
+        mountinfo.read()
+        poller.register(mountinfo, select.POLLPRI | select.POLLERR)
+        uevent = self._open_uevent_socket()
+        if uevent is not None:
+            poller.register(uevent, select.POLLIN)
+        self._wake_fds = os.pipe()
+        poller.register(self._wake_fds[0], select.POLLIN)
+        self.watching = True
+        self._thread = threading.Thread(target=self._run, args=(poller, mountinfo, uevent), name='mounts',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        try:
+            if self._wake_fds is not None:
+                os.write(self._wake_fds[1], b'\0')
+        except OSError:
+            pass
+
+    def _run(self, poller, mountinfo, uevent):
+        try:
+            while True:
+                for fd, _ in poller.poll():
+                    if fd == self._wake_fds[0]:
+                        return
+                    if fd == mountinfo.fileno():
+                        mountinfo.seek(0)
+                        mountinfo.read()
+                        self._mounts_changed()
+                    elif uevent is not None and fd == uevent.fileno():
+                        self._uevent(uevent.recv(65536))
+        finally:
+            self.watching = False
+            mountinfo.close()
+            if uevent is not None:
+                uevent.close()
+            for fd in self._wake_fds:
+                os.close(fd)
+            self._wake_fds = None
+
+    def _mounts_changed(self):
+        try:
+            added, removed = self.refresh()
+        except Exception as e:
+            self.logger.error('Error update mounts: {}'.format(e))
+            return
+        if (added or removed) and self.on_mounts_change is not None:
+            self.on_mounts_change(added, removed)
+
+    def _uevent(self, data):
+        event = parse_uevent(data)
+        if event.get('SUBSYSTEM') != 'block' or event.get('DEVTYPE') != 'disk':
+            return
+        if event.get('ACTION') in ('add', 'remove') and self.on_block_change is not None:
+            self.on_block_change(event['ACTION'], event.get('DEVNAME', ''))
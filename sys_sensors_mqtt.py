@@ -1,118 +1,252 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import datetime as dt
+import collections
 import json
-from os import system, popen
-from threading import Timer
+from os import system
+from threading import Condition, Event, Lock, Thread, Timer
 import time
-import fnmatch
-import re
 
 import paho.mqtt.client as mqtt
 import psutil
-import pytz
 
+from sys_sensors_adaptive import AdaptiveRate
+from sys_sensors_backoff import Backoff
+from sys_sensors_brokers import BrokerLink
+from sys_sensors_commands import CommandExecutor
+from sys_sensors_device import SensorsDevice
+from sys_sensors_history import History
+from sys_sensors_metrics import MetricsServer, SelfMetrics, StartupTimer
+from sys_sensors_mounts import MountWatcher
+from sys_sensors_plugins import Metric, load_plugins
+from sys_sensors_proc import SystemStats
+from sys_sensors_sampling import Sampler
+from sys_sensors_smart import SmartCollector
+from sys_sensors_thermal import ThermalZones
 
-class MainProcess(object):
+# Settings that are applied only on start, reload keeps their current values.
+RESTART_SETTINGS = ('client_id', 'asyncio', 'brokers', 'commands', 'adaptive', 'collectors', 'thermal', 'plugins',
+                    'sampling', 'outbox', 'history', 'metrics', 'aggregator', 'log_file', 'logging_level')
+# Settings that change discovery configs or command topics.
+SESSION_SETTINGS = ('device_name', 'topic', 'homeassistant', 'reboot/shutdown')
+# Fast collectors published at once after start, the others (disks, SMART devices) follow.
+FIRST_STATE_COLLECTORS = ('memory', 'last_boot', 'temperature')
+# Seconds between start and first SMART refresh (if not requested earlier).
+SMART_START_DELAY = 30.
+
+
+class MainProcess(SensorsDevice):
+    """This machine as a device: local sensors, MQTT connection, commands, outbox, history and metrics."""
 
     def __init__(self, logger_obj, settings_dict):
-        self.settings = settings_dict
-        self.logger = logger_obj
-        self.disks = []
-        self.devices = {}
-        self.mqtt_client = None
+        self.startup = StartupTimer()
+        self.startup.mark('imports and settings')
+        super().__init__(logger_obj, settings_dict)
+        self.first_session = True
+        self.smart = None
+        self.mounts = None
+        self.thermal = None
+        self.system = None
+        self.plugins = []
+        self.sampler = None
+        self.register_collectors()
+        timeouts = self.settings['collectors']['timeout']
+        self.metrics = SelfMetrics()
+        if self.settings['metrics']['enabled']:
+            self.collectors.register('agent', self.get_agent_metrics, timeouts['agent'])
+        self.metrics_server = None
+        if self.settings['metrics']['prometheus_port']:
+            self.metrics_server = MetricsServer(self.logger, self.settings['metrics']['prometheus_host'],
+                                                self.settings['metrics']['prometheus_port'], self.prometheus_text)
+        for name in self.collectors.collectors:
+            self.scheduler.add(name, self.interval(name))
+        self.adaptive = None
+        self.adaptive_collectors = []
+        if self.settings['adaptive']['enabled']:
+            adaptive = self.settings['adaptive']
+            self.adaptive = AdaptiveRate(adaptive['thresholds'], adaptive['min_interval'], adaptive['max_interval'],
+                                         adaptive['samples'])
+            self.adaptive_collectors = [name for name in adaptive['collectors'] if name in self.collectors.collectors]
+        self.brokers = [BrokerLink(self.logger, options, '{}_{}'.format(self.settings['client_id'], i),
+                                   self.settings['mqtt']['reconnect_min'], self.settings['mqtt']['reconnect_max'])
+                        for i, options in enumerate(self.settings['brokers'], 1)]
         self.is_run = False
         self.publish_timer = Timer(self.settings['update_interval'], self.mqtt_publish_timer)
-        self.identifier = self.settings['device_name'].replace(' ', '_').lower()
-        self.state_topic = '{}/{}/state'.format(self.settings['topic'], self.identifier)
-
-    def utc_from_timestamp(self, timestamp: float) -> dt.datetime:
-        """Return a UTC time from a timestamp."""
-        return pytz.utc.localize(dt.datetime.utcfromtimestamp(timestamp))
+        self.publish_timer_lock = Lock()
+        # Update cycles and settings reload do not run at once.
+        self.update_lock = Lock()
+        self.stop_event = Event()
+        # Wakes main thread to stop or to apply reload_request (settings loader set by signal handler).
+        self.main_event = Event()
+        self.reload_request = None
+        self.backoff = Backoff(self.settings['mqtt']['reconnect_min'], self.settings['mqtt']['reconnect_max'])
+        self.connect_attempts = 0
+        self.disconnected_time = 0.
+        self.disconnected_since = time.monotonic()
+        if self.settings['outbox']['enabled']:
+            # Imported only when enabled, sqlite3 is slow to import.
+            from sys_sensors_outbox import Outbox
+            self.outbox = Outbox(self.logger, self.settings['outbox']['file'], self.settings['outbox']['max_rows'],
+                                 self.settings['outbox']['eviction'], self.settings['outbox']['batch'],
+                                 self.settings['outbox']['rate'])
+        commands = self.settings['commands']
+        self.commands = CommandExecutor(self.logger, self.send_command_response, self.dispatch_command,
+                                        commands['queue'])
+        self.commands.register('reboot', self.command_reboot, commands['min_interval']['reboot'])
+        self.commands.register('shutdown', self.command_shutdown, commands['min_interval']['shutdown'])
+        self.commands.register('force_update', self.command_force_update, commands['min_interval']['force_update'],
+                               commands['window'])
+        self.history = None
+        if self.settings['history']['enabled']:
+            self.history = History(self.logger, self.settings['history']['file'], self.settings['history']['capacity'])
+        # History requests wait for the history worker thread, more than 'history: queue' are answered busy.
+        self.history_requests = collections.deque()
+        self.history_condition = Condition()
+        self.history_running = False
+        self.history_thread = None
+        self.startup.mark('init')
 
-    def as_local(self, dattim: dt.datetime) -> dt.datetime:
-        """Convert a UTC datetime object to local time zone."""
-        if dattim.tzinfo == self.settings['timezone']:
-            return dattim
-        if dattim.tzinfo is None:
-            dattim = pytz.utc.localize(dattim)
-        return dattim.astimezone(self.settings['timezone'])
+    def register_collectors(self):
+        """Create sources of local sensors and register their collectors."""
+        self.smart = SmartCollector(self.logger, self.settings['intervals']['smart'])
+        self.smart.on_change = lambda: self.request_update(['devices'])
+        self.mounts = MountWatcher(self.logger, self.on_mounts_change, self.on_block_change)
+        timeouts = self.settings['collectors']['timeout']
+        self.collectors.register('memory', lambda: {'memory_use': self.get_memory_usage()}, timeouts['memory'])
+        self.collectors.register('last_boot', lambda: {'last_boot': self.get_last_boot()}, timeouts['last_boot'])
+        self.collectors.register('disks', self.get_disks, timeouts['disks'])
+        self.collectors.register('devices', self.get_devices, timeouts['devices'])
+        thermal = self.settings['thermal']
+        self.thermal = ThermalZones(self.logger, thermal['aliases'], thermal['aggregates'], thermal['rediscover'])
+        self.collectors.register('temperature', self.get_temperatures, timeouts['temperature'])
+        if self.settings['collectors']['system']:
+            self.system = SystemStats(self.logger, self.settings['collectors']['top'])
+            for name in self.settings['collectors']['system']:
+                self.collectors.register(name, getattr(self.system, name), timeouts[name])
+        if self.settings['plugins']['enabled']:
+            self.plugins = load_plugins(self.logger, self.settings['plugins']['enabled'],
+                                        self.settings['plugins']['directory'])
+            for plugin in self.plugins:
+                self.collectors.register(plugin.name, plugin.collect, float(timeouts.get(plugin.name, plugin.timeout)))
+        if self.settings['sampling']['enabled']:
+            self.sampler = Sampler(self.logger,
+                                   {'memory_use': lambda: psutil.virtual_memory().percent,
+                                    'soc_temperature': self.read_soc_temperature,
+                                    'cpu_use': lambda: psutil.cpu_percent(interval=None)},
+                                   self.settings['sampling']['interval'], self.settings['sampling']['size'],
+                                   self.settings['sampling']['aggregates'])
+            self.collectors.register('sampling', self.sampler.collect, timeouts['sampling'])
 
     def get_last_boot(self):
         self.logger.debug('Get last boot')
         return str(self.as_local(self.utc_from_timestamp(psutil.boot_time())).isoformat())
 
-    def mqtt_update_sensors(self):
-        payload = {"memory_use": self.get_memory_usage(),
-                   "last_boot": self.get_last_boot(),
-                   }
+    def interval(self, name):
+        """Configured update interval of collector (plugins default to their declared interval)."""
+        if name in self.settings['intervals']:
+            return float(self.settings['intervals'][name])
+        return next(float(plugin.interval) for plugin in self.plugins if plugin.name == name)
+
+    def max_period(self, name):
+        """Longest update interval of collector (adaptive intervals change up to max_interval)."""
+        if name in self.adaptive_collectors:
+            return max(self.interval(name), self.adaptive.max_interval)
+        return self.scheduler.periods[name]
+
+    def update_period(self):
+        return min(self.max_period(name) for name in self.collectors.collectors)
+
+    def mqtt_update_sensors(self, names=None):
+        started = time.monotonic()
         if self.update_disks_list():
             if self.settings['homeassistant']:
                 self.mqtt_send_config()
-        payload.update(self.get_disks())
-        payload.update(self.get_devices())
-        payload.update({"soc_temperature": self.get_temp()})
-        self.mqtt_client.publish(topic=self.state_topic, payload=json.dumps(payload), qos=1, retain=False)
-        self.mqtt_client.publish(topic='{}/{}/force_update'.format(self.settings['topic'], self.identifier),
-                                 payload=b'OFF')
-
-    def get_temp(self):
-        self.logger.debug('Get SOC temperature')
-        temp = '-1'
-        try:
-            temps = psutil.sensors_temperatures()
-        except AttributeError:
-            temps = {}
-        if 'soc_thermal' in temps.keys():
-            temp = str(temps['soc_thermal'][0].current)
-        elif 'sun4i_ts' in temps.keys():
-            temp = str(temps['sun4i_ts'][0].current)
-        elif 'cpu_thermal' in temps.keys():
-            temp = str(temps['cpu_thermal'][0].current)
-        elif 'cpu0-thermal' in temps.keys():
-            temp = str(temps['cpu0-thermal'][0].current)
-        return temp
+        payload, stale = self.collectors.collect(names)
+        self.check_system_changed()
+        self.adapt_intervals(names, stale)
+        self.record_history(names, stale)
+        self.publish_state(payload, stale, names)
+        self.observe_cycle(started, names, stale)
+
+    def record_history(self, names, stale):
+        """Store values of the collectors that ran in this update, values of the others were stored
+        when they ran."""
+        if self.history is not None:
+            self.history.append(self.collectors.results(names, stale))
+
+    def check_system_changed(self):
+        """Send config when temperature sensors, CPU cores, network interfaces or disks of system statistics
+        or metrics of plugins changed."""
+        changed = False
+        for source in [self.thermal, self.system] + self.plugins:
+            if source is not None and source.changed:
+                source.changed = False
+                changed = True
+        if changed and self.settings['homeassistant']:
+            self.mqtt_send_config()
+
+    def adapt_intervals(self, names, stale):
+        """Change intervals of adaptive collectors that were updated."""
+        now = time.monotonic()
+        for name in self.adaptive_collectors:
+            if (names is not None and name not in names) or name in stale:
+                continue
+            period = self.scheduler.periods[name]
+            new_period = self.adaptive.interval(period, self.collectors.collectors[name].last_result, now)
+            if new_period is None or new_period == period:
+                continue
+            self.logger.debug('Update interval of {} changed to {:.0f} seconds'.format(name, new_period))
+            self.scheduler.set_period(name, new_period)
+            if name == 'devices' and self.smart is not None:
+                # SMART cache is refreshed at least every devices interval.
+                smart_interval = min(self.settings['intervals']['smart'], new_period)
+                if smart_interval < self.smart.interval:
+                    self.smart.interval = smart_interval
+                    self.refresh_smart()
+                else:
+                    self.smart.interval = smart_interval
+
+    def observe_cycle(self, started, names, stale):
+        collectors = [collector for name, collector in self.collectors.collectors.items()
+                      if names is None or name in names]
+        self.metrics.observe_cycle(time.monotonic() - started, collectors, stale)
+
+    def state_published(self):
+        if self.first_state:
+            self.first_state = False
+            self.refresh_smart()
+        if self.startup is not None:
+            self.startup.mark('first state')
+            self.logger.info('Startup times since process start: {}'.format(self.startup.report()))
+            self.startup = None
+
+    def read_soc_temperature(self):
+        return self.thermal.read_soc()
+
+    def get_temperatures(self):
+        self.logger.debug('Get temperatures')
+        return self.thermal.collect()
 
     def update_disks_list(self):
+        """Rebuild disks and devices lists from mounted partitions and SMART scan. Return True if a disk or
+        a device was added or removed (discovery configs of removed ones are cleared by mqtt_send_config)."""
         self.logger.debug('Update disks and disks devices lists')
-        update_config = False
-        for disk in psutil.disk_partitions():
-            if disk.mountpoint not in self.disks:
-                self.disks.append(disk.mountpoint)
-                update_config = True
-        try:
-            data = popen('smartctl --scan')
-            temp = data.read().split(' ')
-            devices = fnmatch.filter(temp, '/dev/sd*')
-            for device in devices:
-                if len(device) >= 8:
-                    device = device[:8]
-                    data = popen('smartctl -i {}'.format(device))
-                    res = data.read().splitlines()
-                    for i in range(len(res)):
-                        if 'Serial Number' in res[i]:
-                            temp = res[i].split(':')
-                            if len(temp) == 2:
-                                device_name = re.sub(' +', ' ', temp[1]).replace('-', '_')
-                                if device_name not in self.devices.keys():
-                                    self.devices[device_name] = device
-                                    update_config = True
-                                else:
-                                    if self.devices.get(device_name, '') != device:
-                                        self.devices[device_name] = device
-        except:
-            pass
+        disks = list(dict.fromkeys(disk.mountpoint for disk in self.mounts.get_partitions()))
+        devices = self.smart.get_devices()
+        update_config = set(disks) != set(self.disks) or devices.keys() != self.devices.keys()
+        self.disks = disks
+        self.devices = devices
         return update_config
 
     def get_disks(self):
         self.logger.debug('Get disks usage and total')
         disks_payload = {}
-        for disk in psutil.disk_partitions():
+        for disk in self.mounts.get_partitions():
             if disk.mountpoint in self.disks:
                 try:
-                    disk_usage = str(psutil.disk_usage(disk.mountpoint).percent)
-                    disk_total = '{0:.1f}'.format(psutil.disk_usage(disk.mountpoint).total / 1048576)
+                    usage = psutil.disk_usage(disk.mountpoint)
+                    disk_usage = str(usage.percent)
+                    disk_total = '{0:.1f}'.format(usage.total / 1048576)
                 except PermissionError:
                     disk_usage = '0'
                     disk_total = '0'
@@ -126,305 +260,206 @@ class MainProcess(object):
 
     def get_devices(self):
         self.logger.debug('Get disks devices SMART')
-        devices_payload = {}
-        for device_name in self.devices.keys():
-            device = self.devices[device_name]
-            try:
-                data = popen('smartctl --attributes {}'.format(device))
-                res = data.read().splitlines()
-                device_attr = {}
-                for i in range(len(res)):
-                    line = res[i].split()
-                    if len(line) >= 10:
-                        if line[1] == 'Temperature_Celsius':
-                            device_attr['temperature'] = line[9]
-                        elif line[1] == 'Power_Cycle_Count':
-                            device_attr['power_cycle_count'] = line[9]
-                        elif line[1] == 'Power_On_Hours':
-                            device_attr['power_on_hours'] = line[9]
-                        elif line[1] == 'Power_On_Hours_and_Msec':
-                            values = line[9].split('+')
-                            if len(values) > 1:
-                                if 'h' in values[0]:
-                                    device_attr['power_on_hours'] = values[0].replace('h', '')
-                if device_attr:
-                    device_name_ = device_name.replace(' ', '_').lower()
-                    devices_payload.update({
-                        'temperature_{}'.format(device_name_): str(device_attr.get('temperature', '-1')),
-                        'power_cycle_count_{}'.format(device_name_): str(device_attr.get('power_cycle_count', '-1')),
-                        'power_on_hours_{}'.format(device_name_): str(device_attr.get('power_on_hours', '-1')),
-                    })
-            except:
-                self.logger.error('Error read SMART data for {}'.format(device_name))
-        return devices_payload
+        return self.devices_payload(self.smart.get_records())
+
+    def mqtt_queue_length(self):
+        """Return number of MQTT packets waiting to be sent by paho."""
+        if self.mqtt_client is None:
+            return 0
+        return len(getattr(self.mqtt_client, '_out_packet', ()))
+
+    def get_disconnected_time(self):
+        if self.disconnected_since is None:
+            return self.disconnected_time
+        return self.disconnected_time + time.monotonic() - self.disconnected_since
+
+    def get_agent_metrics(self):
+        self.logger.debug('Get agent metrics')
+        rss, cpu_time = self.metrics.process_stats()
+        payload = {'agent_cycle_time': '{0:.1f}'.format(1000. * self.metrics.last_cycle),
+                   'agent_rss': '{0:.1f}'.format(rss / 1048576),
+                   'agent_cpu_time': '{0:.1f}'.format(cpu_time),
+                   'agent_published': str(self.metrics.published),
+                   'agent_queue': str(self.mqtt_queue_length()),
+                   'agent_connect_attempts': str(self.connect_attempts),
+                   'agent_disconnected_time': '{0:.1f}'.format(self.get_disconnected_time())}
+        for name, latency in list(self.metrics.last_latency.items()):
+            payload['agent_latency_{}'.format(name)] = '{0:.1f}'.format(1000. * latency)
+        return payload
+
+    def prometheus_text(self):
+        return self.metrics.prometheus_text({
+            'sys_sensors_mqtt_queue': ('gauge', self.mqtt_queue_length()),
+            'sys_sensors_connect_attempts_total': ('counter', self.connect_attempts),
+            'sys_sensors_disconnected_seconds_total': ('counter', self.get_disconnected_time()),
+            'sys_sensors_connected': ('gauge', int(self.connected))})
 
     def get_memory_usage(self):
         self.logger.debug('Get memory usage')
         return str(psutil.virtual_memory().percent)
 
-    def mqtt_send_config(self):
-        retain = True
-        device_payload = {'device': {
-            'identifiers': ['{}'.format(self.identifier)],
-            'name': '{}'.format(self.settings['device_name']),
-            'model': self.settings['model'],
-            'manufacturer': self.settings['manufacturer']
-        }
-        }
-        # SOC temperature.
-        payload = {'name': '{} SOC temperature'.format(self.settings['device_name']),
-                   'state_topic': self.state_topic,
-                   'device_class': 'temperature',
-                   'unit_of_measurement': '°C',
-                   'value_template': '{{ value_json.soc_temperature }}',
-                   'unique_id': '{}_sensor_soc_temperature'.format(self.identifier),
-                   'json_attributes_topic': self.state_topic,
-                   'expire_after': self.settings['update_interval'] + 120,
-                   }
-        payload.update(device_payload)
-        self.mqtt_client.publish(
-            topic='homeassistant/sensor/{0}/soc_temperature/config'.format(self.identifier),
-            payload=json.dumps(payload),
-            qos=1,
-            retain=retain
-        )
-        # Disks use and total.
-        for disk in self.disks:
-            disk_ = disk.replace('/', '_')
-            disk_ = disk_.replace(':\\', '')
-            payload = {'name': '{} Disk use {}'.format(self.settings['device_name'], disk_),
-                       'state_topic': self.state_topic,
-                       'unit_of_measurement': '%',
-                       'icon': 'mdi:harddisk',
-                       'value_template': '{{{{ value_json.disk_use_{} }}}}'.format(disk_),
-                       'unique_id': '{0}_sensor_disk_use_{1}'.format(self.identifier, disk_),
-                       'json_attributes_topic': self.state_topic,
-                       'expire_after': self.settings['update_interval'] + 120,
-                       }
-            payload.update(device_payload)
-            self.mqtt_client.publish(
-                topic='homeassistant/sensor/{0}/disk_use_{1}/config'.format(self.identifier, disk_),
-                payload=json.dumps(payload),
-                qos=1,
-                retain=retain
-            )
-            payload = {'name': '{} Disk total {}'.format(self.settings['device_name'], disk_),
-                       'state_topic': self.state_topic,
-                       'unit_of_measurement': 'MB',
-                       'icon': 'mdi:harddisk',
-                       'value_template': '{{{{ value_json.disk_total_{} }}}}'.format(disk_),
-                       'unique_id': '{0}_sensor_disk_total_{1}'.format(self.identifier, disk_),
-                       'json_attributes_topic': self.state_topic,
-                       'expire_after': self.settings['update_interval'] + 120,
-                       }
-            payload.update(device_payload)
-            self.mqtt_client.publish(
-                topic='homeassistant/sensor/{0}/disk_total_{1}/config'.format(self.identifier, disk_),
-                payload=json.dumps(payload),
-                qos=1,
-                retain=retain
-            )
-        # Devices.
-        for device_name in self.devices.keys():
-            device_name_ = device_name.replace(' ', '_').lower()
-            payload = {'name': '{} {} temperature'.format(self.settings['device_name'], device_name),
-                       'state_topic': self.state_topic,
-                       'unit_of_measurement': '°C',
-                       'device_class': 'temperature',
-                       'value_template': '{{{{ value_json.temperature_{} }}}}'.format(device_name_),
-                       'unique_id': '{0}_sensor_temperature_{1}'.format(self.identifier, device_name_),
-                       'json_attributes_topic': self.state_topic,
-                       'expire_after': self.settings['update_interval'] + 120,
-                       }
-            payload.update(device_payload)
-            self.mqtt_client.publish(
-                topic='homeassistant/sensor/{0}/temperature_{1}/config'.format(self.identifier, device_name_),
-                payload=json.dumps(payload),
-                qos=1,
-                retain=retain
-            )
-            payload = {'name': '{} {} Power Cycle Count'.format(self.settings['device_name'], device_name),
-                       'state_topic': self.state_topic,
-                       'unit_of_measurement': 'i',
-                       'value_template': '{{{{ value_json.power_cycle_count_{} }}}}'.format(device_name_),
-                       'unique_id': '{0}_sensor_power_cycle_count_{1}'.format(self.identifier, device_name_),
-                       'json_attributes_topic': self.state_topic,
-                       'expire_after': self.settings['update_interval'] + 120,
-                       }
-            payload.update(device_payload)
-            self.mqtt_client.publish(
-                topic='homeassistant/sensor/{0}/power_cycle_count_{1}/config'.format(self.identifier, device_name_),
-                payload=json.dumps(payload),
-                qos=1,
-                retain=retain
-            )
-            payload = {'name': '{} {} Power On Hours'.format(self.settings['device_name'], device_name),
-                       'state_topic': self.state_topic,
-                       'unit_of_measurement': 'h',
-                       'value_template': '{{{{ value_json.power_on_hours_{} }}}}'.format(device_name_),
-                       'unique_id': '{0}_sensor_power_on_hours_{1}'.format(self.identifier, device_name_),
-                       'json_attributes_topic': self.state_topic,
-                       'expire_after': self.settings['update_interval'] + 120,
-                       }
-            payload.update(device_payload)
-            self.mqtt_client.publish(
-                topic='homeassistant/sensor/{0}/power_on_hours_{1}/config'.format(self.identifier, device_name_),
-                payload=json.dumps(payload),
-                qos=1,
-                retain=retain
-            )
-        # Memory use.
-        payload = {'name': '{} Memory use'.format(self.settings['device_name']),
-                   'state_topic': self.state_topic,
-                   'unit_of_measurement': '%',
-                   'icon': 'mdi:memory',
-                   'value_template': '{{ value_json.memory_use }}',
-                   'unique_id': '{}_sensor_memory_use'.format(self.identifier),
-                   'json_attributes_topic': self.state_topic,
-                   'expire_after': self.settings['update_interval'] + 120,
-                   }
-        payload.update(device_payload)
-        self.mqtt_client.publish(
-            topic='homeassistant/sensor/{0}/memory_use/config'.format(self.identifier),
-            payload=json.dumps(payload),
-            qos=1,
-            retain=retain
-        )
-        # Last boot.
-        payload = {'device_class': 'timestamp',
-                   'name': '{} Last boot'.format(self.settings['device_name']),
-                   'state_topic': self.state_topic,
-                   'icon': 'mdi:clock-start',
-                   'value_template': '{{ value_json.last_boot }}',
-                   'unique_id': '{}_sensor_last_boot'.format(self.identifier),
-                   'json_attributes_topic': self.state_topic,
-                   'expire_after': self.settings['update_interval'] + 120,
-                   }
-        payload.update(device_payload)
-        self.mqtt_client.publish(
-            topic='homeassistant/sensor/{0}/last_boot/config'.format(self.identifier),
-            payload=json.dumps(payload),
-            qos=1,
-            retain=retain
-        )
-        # Force update switch.
-        payload = {'name': '{} Force update'.format(self.settings['device_name']),
-                   'state_topic': '{}/{}/force_update'.format(self.settings['topic'], self.identifier),
-                   'command_topic': '{}/{}/force_update'.format(self.settings['topic'], self.identifier),
-                   'unique_id': '{}_force_update'.format(self.identifier)
-                   }
-        payload.update(device_payload)
-        self.mqtt_client.publish(
-            topic='homeassistant/switch/{0}/force_update/config'.format(self.identifier),
-            payload=json.dumps(payload),
-            qos=1,
-            retain=retain
-        )
-        self.mqtt_client.publish(topic='{}/{}/force_update'.format(self.settings['topic'], self.identifier),
-                                 payload='OFF', qos=1, retain=False)
-        if self.settings['reboot/shutdown']:
-            # Reboot switch.
-            payload = {'name': '{} Reboot'.format(self.settings['device_name']),
-                       'state_topic': '{}/{}/reboot'.format(self.settings['topic'], self.identifier),
-                       'command_topic': '{}/{}/reboot'.format(self.settings['topic'], self.identifier),
-                       'icon': 'mdi:restart',
-                       'unique_id': '{}_reboot'.format(self.identifier)
-                       }
-            payload.update(device_payload)
-            self.mqtt_client.publish(
-                topic='homeassistant/switch/{0}/reboot/config'.format(self.identifier),
-                payload=json.dumps(payload),
-                qos=1,
-                retain=retain
-            )
-            self.mqtt_client.publish(topic='{}/{}/reboot'.format(self.settings['topic'], self.identifier),
-                                     payload='OFF', qos=1, retain=False)
-            # Shutdown switch.
-            payload = {'name': '{} Shutdown'.format(self.settings['device_name']),
-                       'state_topic': '{}/{}/shutdown'.format(self.settings['topic'], self.identifier),
-                       'command_topic': '{}/{}/shutdown'.format(self.settings['topic'], self.identifier),
-                       'icon': 'mdi:power',
-                       'unique_id': '{}_shutdown'.format(self.identifier)
-                       }
-            payload.update(device_payload)
-            self.mqtt_client.publish(
-                topic='homeassistant/switch/{0}/shutdown/config'.format(self.identifier),
-                payload=json.dumps(payload),
-                qos=1,
-                retain=retain
-            )
-            self.mqtt_client.publish(topic='{}/{}/shutdown'.format(self.settings['topic'], self.identifier),
-                                     payload='OFF', qos=1, retain=False)
+    def sensors(self) -> list:
+        """Return Metric of every published sensor."""
+        sensors = super().sensors()
+        # Sampled metrics aggregates.
+        if self.sampler is not None:
+            for metric in (Metric('memory_use', 'Memory use', unit='%', icon='mdi:memory'),
+                           Metric('soc_temperature', 'SOC temperature', unit='°C', device_class='temperature'),
+                           Metric('cpu_use', 'CPU use', unit='%', icon='mdi:cpu-64-bit')):
+                for aggregate in self.sampler.aggregates:
+                    sensors.append(metric._replace(key='{}_{}'.format(metric.key, aggregate),
+                                                   name='{} {}'.format(metric.name, aggregate)))
+        # Temperature sensors and their aggregates.
+        if self.thermal is not None:
+            sensors.extend(self.thermal.sensors())
+        # System statistics.
+        if self.system is not None:
+            sensors.extend(self.system.sensors(self.settings['collectors']['system']))
+        # Collector plugins.
+        for plugin in self.plugins:
+            sensors.extend(plugin.get_metrics())
+        return sensors
 
     def mqtt_connect(self):
-        con_ok = False
-        while not con_ok and self.is_run:
-            try:
-                self.mqtt_client.connect(self.settings['mqtt']['hostname'], self.settings['mqtt']['port'])
-                con_ok = True
-            except:
-                self.logger.debug('No connection to {}:{}'.format(self.settings['mqtt']['hostname'],
-                                  self.settings['mqtt']['port']))
-                self.logger.debug('Reconnect in 60 seconds')
-                time.sleep(60)
-                self.logger.debug('Reconnect to MQTT broker')
+        """Start connecting in paho network thread. Failed connects and reconnects are retried by paho
+        with delays from self.backoff, waits end on loop_stop."""
+        self.mqtt_client.connect_async(self.settings['mqtt']['hostname'], self.settings['mqtt']['port'])
+        self.mqtt_client.loop_start()
+
+    def set_reconnect_delay(self):
+        delay = self.backoff.next_delay()
+        self.mqtt_client.reconnect_delay_set(min_delay=delay, max_delay=self.backoff.maximum)
+        self.logger.debug('Reconnect to {}:{} in {:.1f} seconds'.format(self.settings['mqtt']['hostname'],
+                                                                         self.settings['mqtt']['port'], delay))
+
+    def connection_attempt(self, success):
+        self.connect_attempts += 1
+        if success:
+            self.backoff.reset()
+            if self.disconnected_since is not None:
+                self.disconnected_time += time.monotonic() - self.disconnected_since
+                self.disconnected_since = None
+
+    def on_connect_fail(self, client, userdata):
+        self.logger.debug('No connection to {}:{}'.format(self.settings['mqtt']['hostname'],
+                                                          self.settings['mqtt']['port']))
+        self.connection_attempt(False)
+        self.set_reconnect_delay()
 
     def on_message(self, client, userdata, message):
         self.logger.debug('Message received: {} = {}'.format(message.topic, message.payload))
-        if message.topic == '{}/{}/reboot'.format(self.settings['topic'], self.identifier):
+        if message.topic == self.discovery.fingerprint_topic:
+            self.discovery.verify(message.payload)
+        elif message.topic == '{}/{}/reboot'.format(self.settings['topic'], self.identifier):
             if message.payload == b'ON':
                 self.logger.info('Reboot command')
-                try:
-                    system('reboot')
-                except:
-                    self.logger.error('Error reboot')
+                self.commands.submit('reboot')
         elif message.topic == '{}/{}/shutdown'.format(self.settings['topic'], self.identifier):
             if message.payload == b'ON':
                 self.logger.info('Shutdown command')
-                try:
-                    system('shutdown now -h')
-                except:
-                    self.logger.error('Error shutdown')
+                self.commands.submit('shutdown')
         elif message.topic == '{}/{}/force_update'.format(self.settings['topic'], self.identifier):
             if message.payload == b'ON':
                 self.logger.debug('Force update command')
-                try:
-                    self.publish_timer.cancel()
-                except:
-                    self.logger.error('Error cancel publish timer')
-                self.mqtt_publish_timer()
+                self.commands.submit('force_update')
+        elif message.topic == '{}/{}/history'.format(self.settings['topic'], self.identifier):
+            if self.history is not None:
+                self.command_history(message.payload)
+
+    def dispatch_command(self, func, *args):
+        """Run command handler or response (called on command executor thread)."""
+        func(*args)
+
+    def send_command_response(self, name, status, merged):
+        if self.connected:
+            self.mqtt_client.publish(topic='{}/{}/{}/response'.format(self.settings['topic'], self.identifier, name),
+                                     payload=json.dumps({'command': name, 'status': status, 'merged': merged}),
+                                     qos=1, retain=False)
+
+    def command_reboot(self):
+        try:
+            system('reboot')
+        except:
+            self.logger.error('Error reboot')
+
+    def command_shutdown(self):
+        try:
+            system('shutdown now -h')
+        except:
+            self.logger.error('Error shutdown')
+
+    def command_force_update(self):
+        self.scheduler.reset()
+        self.delta.reset()
+        # Update in publish timer thread, not in command executor thread.
+        self.restart_publish_timer(0)
+
+    def command_history(self, payload):
+        # Query may take a while, do not block MQTT network thread.
+        with self.history_condition:
+            if len(self.history_requests) < self.settings['history']['queue']:
+                self.history_requests.append(payload)
+                self.history_condition.notify()
+                return
+        self.logger.debug('History request rejected, queue is full')
+        try:
+            request = json.loads(payload)
+        except ValueError:
+            request = None
+        self.send_history_response({'id': request.get('id') if isinstance(request, dict) else None,
+                                    'status': 'busy'})
+
+    def history_worker(self):
+        while True:
+            with self.history_condition:
+                while self.history_running and not self.history_requests:
+                    self.history_condition.wait()
+                if not self.history_running:
+                    return
+                payload = self.history_requests.popleft()
+            self.answer_history(payload)
+
+    def send_history_response(self, response):
+        self.mqtt_client.publish(topic='{}/{}/history/response'.format(self.settings['topic'], self.identifier),
+                                 payload=json.dumps(response), qos=1, retain=False)
+
+    def answer_history(self, payload):
+        """Publish history values requested by payload (JSON object with optional id, keys, start, end
+        and step, negative start and end are seconds before now)."""
+        try:
+            request = json.loads(payload)
+            if not isinstance(request, dict):
+                raise ValueError('not an object')
+            now = time.time()
+            start, end = request.get('start'), request.get('end')
+            start = None if start is None else float(start) + (now if float(start) < 0 else 0.)
+            end = None if end is None else float(end) + (now if float(end) < 0 else 0.)
+            step = max(0., float(request.get('step') or 0.))
+            keys = request.get('keys')
+            if keys is not None:
+                keys = [str(key) for key in (keys if isinstance(keys, list) else [keys])]
+        except (TypeError, ValueError) as e:
+            self.logger.error('Invalid history request {}: {}'.format(payload, e))
+            return
+        started = time.monotonic()
+        series = self.history.query(keys, start, end, step, self.settings['history']['max_points'])
+        self.logger.debug('History query done in {:.1f} ms'.format(1000 * (time.monotonic() - started)))
+        self.send_history_response({'id': request.get('id'), 'status': 'done', 'start': start, 'end': end,
+                                    'step': step, 'series': series})
 
     def on_connect(self, client, userdata, flags, rc):
+        self.connection_attempt(rc == 0)
         if rc == 0:
-            self.logger.debug('Connection to MQTT broker successful')
-            self.update_disks_list()
-            if self.settings['homeassistant']:
-                self.mqtt_send_config()
-                self.logger.debug('Sent config to MQTT broker')
-            self.publish_timer = Timer(10, self.mqtt_publish_timer)
-            self.publish_timer.start()
-            # Subscribe force update topic.
-            (result, mid) = self.mqtt_client.subscribe('{}/{}/force_update'.format(self.settings['topic'],
-                                                                                   self.identifier))
-            if result == mqtt.MQTT_ERR_SUCCESS:
-                self.logger.debug('Successfully subscribed to force update topic')
-            else:
-                self.logger.error('Error subscribe to force update topic')
-            if self.settings['reboot/shutdown']:
-                # Subscribe reboot topic.
-                (result, mid) = self.mqtt_client.subscribe('{}/{}/reboot'.format(self.settings['topic'],
-                                                                                 self.identifier))
-                if result == mqtt.MQTT_ERR_SUCCESS:
-                    self.logger.debug('Successfully subscribed to reboot topic')
-                else:
-                    self.logger.error('Error subscribe to reboot topic')
-                # Subscribe shutdown topic.
-                (result, mid) = self.mqtt_client.subscribe('{}/{}/shutdown'.format(self.settings['topic'],
-                                                                                   self.identifier))
-                if result == mqtt.MQTT_ERR_SUCCESS:
-                    self.logger.debug('Successfully subscribed to shutdown topic')
-                else:
-                    self.logger.error('Error subscribe to shutdown topic')
+            self.logger.info('Connected to MQTT broker on host {}:{} (connect attempts: {}, disconnected for {:.1f} '
+                             'seconds in total)'.format(self.settings['mqtt']['hostname'],
+                                                        self.settings['mqtt']['port'], self.connect_attempts,
+                                                        self.disconnected_time))
+            self.connected = True
+            if self.startup is not None:
+                self.startup.mark('connected')
+            self.start_session()
+            if self.outbox is not None:
+                self.outbox.start_replay(self.outbox_publish)
         elif rc == 1:
             self.logger.error('Connection to MQTT broker refused. Incorrect protocol version')
             self.stop()
@@ -439,39 +474,295 @@ class MainProcess(object):
         elif rc == 5:
             self.logger.error('Connection to MQTT broker refused. Not authorised')
 
+    def start_session(self):
+        """Send configs and switches states, subscribe command topics and publish full state soon
+        (after connect or change of device name or topic)."""
+        self.update_disks_list()
+        if self.settings['homeassistant']:
+            self.discovery.connected(self.mqtt_client)
+            self.mqtt_send_config()
+            self.mqtt_send_switches_state()
+            self.logger.debug('Sent config to MQTT broker')
+        if self.codec.keys:
+            self.publish_keys(self.mqtt_client)
+        self.scheduler.reset()
+        self.delta.reset()
+        if self.first_session:
+            # Minimal state at once (not delta filtered, so the next full state is not either), then full
+            # state and SMART devices.
+            self.first_session = False
+            self.first_state = True
+            for name in self.collectors.collectors:
+                if name not in FIRST_STATE_COLLECTORS:
+                    self.scheduler.set_due(name, 10)
+            self.restart_publish_timer(0)
+        else:
+            self.restart_publish_timer(10)
+        self.subscribe_commands()
+
+    def subscribe_commands(self):
+        # Subscribe force update topic.
+        (result, mid) = self.mqtt_client.subscribe('{}/{}/force_update'.format(self.settings['topic'],
+                                                                               self.identifier))
+        if result == mqtt.MQTT_ERR_SUCCESS:
+            self.logger.debug('Successfully subscribed to force update topic')
+        else:
+            self.logger.error('Error subscribe to force update topic')
+        if self.history is not None:
+            # Subscribe history requests topic.
+            (result, mid) = self.mqtt_client.subscribe('{}/{}/history'.format(self.settings['topic'],
+                                                                              self.identifier))
+            if result == mqtt.MQTT_ERR_SUCCESS:
+                self.logger.debug('Successfully subscribed to history topic')
+            else:
+                self.logger.error('Error subscribe to history topic')
+        if self.settings['reboot/shutdown']:
+            # Subscribe reboot topic.
+            (result, mid) = self.mqtt_client.subscribe('{}/{}/reboot'.format(self.settings['topic'],
+                                                                             self.identifier))
+            if result == mqtt.MQTT_ERR_SUCCESS:
+                self.logger.debug('Successfully subscribed to reboot topic')
+            else:
+                self.logger.error('Error subscribe to reboot topic')
+            # Subscribe shutdown topic.
+            (result, mid) = self.mqtt_client.subscribe('{}/{}/shutdown'.format(self.settings['topic'],
+                                                                               self.identifier))
+            if result == mqtt.MQTT_ERR_SUCCESS:
+                self.logger.debug('Successfully subscribed to shutdown topic')
+            else:
+                self.logger.error('Error subscribe to shutdown topic')
+
+    def unsubscribe_commands(self):
+        topics = ['{}/{}/force_update'.format(self.settings['topic'], self.identifier)]
+        if self.history is not None:
+            topics.append('{}/{}/history'.format(self.settings['topic'], self.identifier))
+        if self.settings['reboot/shutdown']:
+            topics.append('{}/{}/reboot'.format(self.settings['topic'], self.identifier))
+            topics.append('{}/{}/shutdown'.format(self.settings['topic'], self.identifier))
+        self.mqtt_client.unsubscribe(topics)
+
     def on_disconnect(self, client, userdata, rc):
         self.logger.debug('Disconnected from MQTT broker. {}'.format(rc))
-        self.publish_timer.cancel()
+        if self.disconnected_since is None:
+            self.disconnected_since = time.monotonic()
+        self.connected = False
+        self.set_reconnect_delay()
+        if self.outbox is None:
+            self.publish_timer.cancel()
+        else:
+            # Keep collecting, states are stored to outbox.
+            self.outbox.stop_replay()
+        self.discovery.disconnected()
         if self.settings['reboot/shutdown']:
             self.mqtt_client.unsubscribe('{}/{}/reboot'.format(self.settings['topic'], self.identifier))
             self.mqtt_client.unsubscribe('{}/{}/shutdown'.format(self.settings['topic'], self.identifier))
 
+    def on_mounts_change(self, added, removed):
+        self.logger.info('Mounts changed, added: {}, removed: {}'.format(', '.join(added) or '-',
+                                                                         ', '.join(removed) or '-'))
+        self.request_update(['disks'])
+
+    def on_block_change(self, action, devname):
+        self.logger.info('Block device {}: {}'.format(action, devname))
+        self.refresh_smart()
+
+    def refresh_smart(self):
+        if self.smart is not None:
+            self.smart.request_refresh()
+
+    def request_update(self, names):
+        """Update sensors now (called from watcher threads on mounts and devices changes)."""
+        for name in names:
+            self.scheduler.set_due(name)
+        if self.is_run and (self.connected or self.outbox is not None):
+            self.restart_publish_timer(0)
+
+    def reload_settings(self, settings):
+        """Apply reloaded settings without restart.
+
+        Intervals, publish options, device name and topic, Home Assistant options and broker are applied in
+        place (configs are republished, broker is reconnected if changed), settings from RESTART_SETTINGS
+        keep their current values.
+        """
+        changed = [key for key in settings if settings[key] != self.settings.get(key)]
+        for key in changed:
+            if key in RESTART_SETTINGS:
+                self.logger.warning('Setting {} changed, restart to apply'.format(key))
+        changed = [key for key in changed if key not in RESTART_SETTINGS]
+        if not changed:
+            self.logger.info('Settings reloaded, nothing to apply')
+            return
+        self.logger.info('Apply reloaded settings: {}'.format(', '.join(changed)))
+        identity = 'device_name' in changed or 'topic' in changed
+        session = self.connected and any(key in changed for key in SESSION_SETTINGS)
+        if session:
+            # Remove configs and subscriptions of the old device and topic.
+            if self.settings['homeassistant'] and (identity or not settings['homeassistant']):
+                self.discovery.update({})
+                self.discovery.publish()
+            self.discovery.disconnected()
+            self.unsubscribe_commands()
+        for key in changed:
+            self.settings[key] = settings[key]
+        if 'intervals' in changed:
+            for name in self.collectors.collectors:
+                self.scheduler.set_period(name, self.interval(name))
+            if self.smart is not None:
+                self.smart.interval = self.settings['intervals']['smart']
+        if 'publish' in changed:
+            self.create_publish_filters()
+        if identity:
+            self.set_identity()
+        if 'mqtt' in changed:
+            self.backoff = Backoff(self.settings['mqtt']['reconnect_min'], self.settings['mqtt']['reconnect_max'])
+            self.mqtt_client.username_pw_set(self.settings['mqtt']['user'], self.settings['mqtt']['password'])
+            self.logger.info('Reconnecting to MQTT broker on host {}:{}'.format(self.settings['mqtt']['hostname'],
+                                                                                self.settings['mqtt']['port']))
+            self.reconnect()
+        elif session:
+            self.start_session()
+        elif self.connected:
+            if self.settings['homeassistant']:
+                # Only changed configs (expire_after, state templates, device) are republished.
+                self.mqtt_send_config()
+            if self.codec.keys:
+                self.publish_keys(self.mqtt_client)
+        if self.is_run and (self.connected or self.outbox is not None):
+            self.restart_publish_timer(self.scheduler.next_due())
+
+    def reconnect(self):
+        """Connect to broker from settings again."""
+        self.mqtt_client.disconnect()
+        self.mqtt_client.loop_stop()
+        self.mqtt_connect()
+
+    def request_reload(self, load):
+        """Reload settings returned by load() (None if invalid) on the main thread (called from signal
+        handler)."""
+        self.reload_request = load
+        self.main_event.set()
+
+    def apply_reload(self):
+        load, self.reload_request = self.reload_request, None
+        if load is None:
+            return
+        settings = load()
+        if settings is not None:
+            with self.update_lock:
+                self.reload_settings(settings)
+
     def mqtt_publish_timer(self):
-        self.mqtt_update_sensors()
-        self.logger.debug('Updated sensors states to MQTT broker')
-        self.logger.debug('Next update in {} seconds'.format(self.settings['update_interval']))
-        self.publish_timer = Timer(self.settings['update_interval'], self.mqtt_publish_timer)
-        self.publish_timer.start()
+        with self.update_lock:
+            due = self.scheduler.pop_due()
+            if due:
+                self.mqtt_update_sensors(due)
+                self.logger.debug('Updated sensors states to MQTT broker: {}'.format(', '.join(due)))
+        next_update = self.scheduler.next_due()
+        self.logger.debug('Next update in {:.1f} seconds'.format(next_update))
+        self.restart_publish_timer(next_update)
+
+    def restart_publish_timer(self, delay):
+        with self.publish_timer_lock:
+            self.publish_timer.cancel()
+            self.publish_timer = Timer(delay, self.mqtt_publish_timer)
+            self.publish_timer.start()
+
+    def outbox_publish(self, topic, payload):
+        if not self.connected:
+            return False
+        return self.mqtt_client.publish(topic=topic, payload=payload, qos=1, retain=False).rc == mqtt.MQTT_ERR_SUCCESS
+
+    def create_mqtt_client(self):
+        client = mqtt.Client(client_id=self.settings['client_id'])
+        client.username_pw_set(self.settings['mqtt']['user'], self.settings['mqtt']['password'])
+        client.on_connect = self.on_connect
+        client.on_disconnect = self.on_disconnect
+        client.on_connect_fail = self.on_connect_fail
+        client.on_message = self.on_message
+        client.on_publish = self.metrics.on_publish
+        return client
+
+    def start_workers(self):
+        if self.smart is not None:
+            self.smart.start(SMART_START_DELAY)
+        if self.mounts is not None:
+            self.mounts.start()
+        self.commands.start()
+        for broker in self.brokers:
+            broker.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.outbox is not None:
+            self.outbox.open()
+        if self.history is not None:
+            self.history.open()
+            self.start_history_worker()
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def start_history_worker(self):
+        if self.history_thread is None:
+            self.history_running = True
+            self.history_thread = Thread(target=self.history_worker, name='history', daemon=True)
+            self.history_thread.start()
+
+    def stop_history_worker(self):
+        with self.history_condition:
+            self.history_running = False
+            self.history_requests.clear()
+            self.history_condition.notify()
+        if self.history_thread is not None:
+            self.history_thread.join(5.)
+            self.history_thread = None
+
+    def stop_workers(self):
+        if self.smart is not None:
+            self.smart.stop()
+        if self.mounts is not None:
+            self.mounts.stop()
+        self.commands.stop()
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.collectors.stop()
+        if self.outbox is not None:
+            self.outbox.close()
+        if self.history is not None:
+            self.stop_history_worker()
+            self.history.close()
+        if self.system is not None:
+            self.system.close()
+        for plugin in self.plugins:
+            plugin.close()
+        if self.thermal is not None:
+            self.thermal.close()
+        for broker in self.brokers:
+            broker.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
 
     def run(self):
-        self.mqtt_client = mqtt.Client(client_id=self.settings['client_id'])
-        self.mqtt_client.username_pw_set(self.settings['mqtt']['user'], self.settings['mqtt']['password'])
-        self.mqtt_client.on_connect = self.on_connect
-        self.mqtt_client.on_disconnect = self.on_disconnect
-        self.mqtt_client.on_message = self.on_message
+        self.mqtt_client = self.create_mqtt_client()
         self.logger.info('Connecting to MQTT broker on host {}:{}'.format(self.settings['mqtt']['hostname'],
                                                                           self.settings['mqtt']['port']))
         self.is_run = True
+        self.stop_event.clear()
+        self.start_workers()
+        self.startup.mark('workers')
+        if self.outbox is not None:
+            # Collect to outbox from the start, broker may be unreachable (session restarts the timer).
+            self.restart_publish_timer(0)
         self.mqtt_connect()
-        self.logger.info('Connected to MQTT broker on host {}:{}'.format(self.settings['mqtt']['hostname'],
-                                                                         self.settings['mqtt']['port']))
-        self.mqtt_client.loop_start()
-        while self.is_run:
-            time.sleep(1)
+        while not self.stop_event.is_set():
+            self.main_event.wait()
+            self.main_event.clear()
+            self.apply_reload()
 
     def stop(self):
         self.logger.info('Stopping')
         self.is_run = False
+        self.stop_event.set()
+        self.main_event.set()
         self.publish_timer.cancel()
+        self.stop_workers()
         self.mqtt_client.loop_stop()
         self.mqtt_client.disconnect()
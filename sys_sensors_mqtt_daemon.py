@@ -6,20 +6,31 @@ import signal
 import sys
 import time
 
-from sys_sensors_mqtt import MainProcess
 from sys_sensors_settings import Settings
 
 
 class App:
     
-    def __init__(self, logger_obj, settings_dict):
+    def __init__(self, logger_obj, settings_obj):
         self.logger = logger_obj
         self.main_process = None
         self.is_run = False
-        self.settings = settings_dict
+        self.settings_obj = settings_obj
+        self.settings = settings_obj.settings
             
     def run(self):
-        self.main_process = MainProcess(self.logger, self.settings)
+        # Only the used process module (and its dependencies, asyncio for example) is imported.
+        if self.settings['aggregator']['enabled']:
+            if self.settings['asyncio']:
+                self.logger.warning('Aggregator mode runs without asyncio')
+            from sys_sensors_aggregator import AggregatorProcess
+            self.main_process = AggregatorProcess(self.logger, self.settings)
+        elif self.settings['asyncio']:
+            from sys_sensors_async import AsyncMainProcess
+            self.main_process = AsyncMainProcess(self.logger, self.settings)
+        else:
+            from sys_sensors_mqtt import MainProcess
+            self.main_process = MainProcess(self.logger, self.settings)
         self.is_run = True
         i = 1
         timer = time.time()
@@ -43,6 +54,13 @@ class App:
             self.logger.info('End SysSensorsMQTT')
             i += 1
 
+    def reload(self):
+        if self.main_process is None or not self.is_run:
+            self.logger.warning('SysSensorsMQTT not started')
+            return
+        # Settings file is read and applied by the process, not in the signal handler.
+        self.main_process.request_reload(self.settings_obj.reload_settings)
+
     def stop(self):
         if self.main_process is not None and self.is_run:
             self.logger.info('SysSensorsMQTT stop')
@@ -58,12 +76,17 @@ def sigterm_handler(_signo, _stack_frame):
     app.stop()
 
 
+def sighup_handler(_signo, _stack_frame):
+    logger.info('Received signal {}, reload settings'.format(_signo))
+    app.reload()
+
+
 if __name__ == "__main__":
     logger = logging.Logger('SysSensorsMQTT')
 
     formatter = logging.Formatter('%(filename)-25s|%(lineno)4d|%(levelname)-7s|%(asctime)-23s|%(message)s')
 
-    settings = Settings(logger)
+    settings = Settings(logger, sys.argv[1] if len(sys.argv) > 1 else 'settings.yaml')
     settings.read_settings()
 
     handler_infos = logging.handlers.RotatingFileHandler(settings.settings['log_file'], maxBytes=1000000, backupCount=1)
@@ -78,9 +101,10 @@ if __name__ == "__main__":
     else:
         handler_infos.setLevel(logging.ERROR)
 
-    app = App(logger, settings.settings)
+    app = App(logger, settings)
 
     signal.signal(signal.SIGTERM, sigterm_handler)
     signal.signal(signal.SIGINT, sigterm_handler)
+    signal.signal(signal.SIGHUP, sighup_handler)
 
     app.run()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+import time
+
+
+class Outbox(object):
+    """Bounded disk-backed (SQLite WAL) queue of messages kept while MQTT broker is unreachable.
+
+    When the queue is full, eviction 'oldest' drops the oldest message, 'downsample' drops every second
+    message of the older half of the queue.
+    """
+
+    def __init__(self, logger_obj, path, max_rows=10000, eviction='oldest', batch=50, rate=20.):
+        self.logger = logger_obj
+        self.path = path
+        self.max_rows = max_rows
+        self.eviction = eviction
+        self.batch = batch
+        self.rate = rate
+        self._db = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def open(self):
+        with self._lock:
+            if self._db is not None:
+                return
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                             'ts REAL NOT NULL, topic TEXT NOT NULL, payload BLOB NOT NULL)')
+
+    def close(self):
+        self.stop_replay()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def put(self, topic, payload, ts=None):
+        if ts is None:
+            ts = time.time()
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        with self._lock:
+            self._db.execute('INSERT INTO outbox (ts, topic, payload) VALUES (?, ?, ?)', (ts, topic, payload))
+            count = self._db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+            if count > self.max_rows:
+                self._evict(count)
+
+    def _evict(self, count):
+        if self.eviction == 'downsample':
+            # Every second row by position (ids of earlier passes are not contiguous), window functions need
+            # SQLite 3.25 or newer.
+            self._db.execute('DELETE FROM outbox WHERE id IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER '
+                             '(ORDER BY id) AS position FROM (SELECT id FROM outbox ORDER BY id LIMIT ?)) '
+                             'WHERE position % 2 = 0)', (count // 2,))
+            count = self._db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+        if count > self.max_rows:
+            self._db.execute('DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)',
+                             (count - self.max_rows,))
+        self.logger.debug('Outbox full, {} eviction'.format(self.eviction))
+
+    def replay(self, publish):
+        """Publish stored messages oldest first, batch messages at a time, at most rate messages per second.
+
+        publish(topic, payload) returns True on success; replay stops on first failure.
+        """
+        sent = 0
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            with self._lock:
+                rows = self._db.execute('SELECT id, topic, payload FROM outbox ORDER BY id LIMIT ?',
+                                        (self.batch,)).fetchall()
+            if not rows:
+                break
+            published = []
+            for row_id, topic, payload in rows:
+                if not publish(topic, payload):
+                    break
+                published.append((row_id,))
+            with self._lock:
+                self._db.executemany('DELETE FROM outbox WHERE id = ?', published)
+            sent += len(published)
+            if len(published) < len(rows):
+                self.logger.debug('Outbox replay interrupted')
+                break
+            self._stop_event.wait(max(0., len(rows) / self.rate - (time.monotonic() - started)))
+        if sent:
+            self.logger.info('Outbox replayed {} messages'.format(sent))
+        return sent
+
+    def start_replay(self, publish):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.replay, args=(publish,), name='outbox', daemon=True)
+        self._thread.start()
+
+    def stop_replay(self):
+        self._stop_event.set()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import os
+from typing import NamedTuple, Optional
+
+# Entry points group of installed collector plugins (name = collector name, value = plugin class).
+ENTRY_POINTS_GROUP = 'sys_sensors_mqtt.collectors'
+
+
+class Metric(NamedTuple):
+    """Sensor published by a collector: payload key and Home Assistant discovery declarations."""
+    key: str
+    name: str
+    unit: Optional[str] = None
+    device_class: Optional[str] = None
+    state_class: Optional[str] = None
+    icon: Optional[str] = None
+
+    def config(self) -> dict:
+        """Discovery config entries of the declared fields."""
+        return {config_key: value for config_key, value in (('unit_of_measurement', self.unit),
+                                                             ('device_class', self.device_class),
+                                                             ('state_class', self.state_class),
+                                                             ('icon', self.icon))
+                if value is not None}
+
+
+class CollectorPlugin(object):
+    """Base class of collector plugins.
+
+    A plugin is a module in the plugins directory (file <name>.py with class Plugin) or a class registered
+    in entry points group 'sys_sensors_mqtt.collectors' under the collector name. It declares its
+    metrics (payload keys, units, device classes) and default interval and timeout, collect returns payload
+    values. When the metrics list changes (for example a new network interface), set changed, so discovery
+    configs are sent again.
+    """
+
+    interval = 300
+    timeout = 5.
+    metrics = ()
+
+    def __init__(self, logger_obj, name, options):
+        self.logger = logger_obj
+        self.name = name
+        self.options = options
+        self.changed = False
+
+    def get_metrics(self) -> list:
+        return list(self.metrics)
+
+    def collect(self) -> dict:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _load_from_directory(directory, name):
+    path = os.path.join(directory, '{}.py'.format(name))
+    if not os.path.isfile(path):
+        return None
+    spec = importlib.util.spec_from_file_location('sys_sensors_plugin_{}'.format(name), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Plugin
+
+
+def _load_from_entry_points(name):
+    from importlib.metadata import entry_points
+    try:
+        found = entry_points(group=ENTRY_POINTS_GROUP)
+    except TypeError:
+        # Python < 3.10.
+        found = entry_points().get(ENTRY_POINTS_GROUP, [])
+    for entry_point in found:
+        if entry_point.name == name:
+            return entry_point.load()
+    return None
+
+
+def load_plugins(logger_obj, enabled: dict, directory) -> list:
+    """Import and create enabled plugins (name -> options). Plugins that are not enabled are not imported."""
+    plugins = []
+    for name, options in enabled.items():
+        try:
+            plugin_class = _load_from_directory(directory, name) or _load_from_entry_points(name)
+            if plugin_class is None:
+                logger_obj.error('Collector plugin {} not found'.format(name))
+                continue
+            plugins.append(plugin_class(logger_obj, name, options))
+        except Exception as e:
+            logger_obj.error('Error load collector plugin {}: {}'.format(name, e))
+    return plugins
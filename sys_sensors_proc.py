@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+import os
+import threading
+import time
+
+from sys_sensors_plugins import Metric
+
+SYSTEM_COLLECTORS = ('cpu', 'load', 'network', 'diskio', 'processes')
+# Virtual block devices without useful I/O statistics.
+SKIP_DISKS = ('loop', 'ram', 'zram', 'dm-', 'md')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class ProcFile(object):
+    """File in /proc kept open and read from offset 0 into a preallocated buffer (grown if too small)."""
+
+    def __init__(self, path, size=8192):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buffer = bytearray(size)
+
+    def read(self) -> bytes:
+        while True:
+            length = os.preadv(self.fd, [self.buffer], 0)
+            if length < len(self.buffer):
+                return bytes(memoryview(self.buffer)[:length])
+            self.buffer = bytearray(2 * len(self.buffer))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _rate(value, previous, elapsed):
+    return max(0, value - previous) / elapsed if elapsed > 0 else 0.
+
+
+class SystemStats(object):
+    """CPU, load, network, disk I/O and processes statistics read from /proc.
+
+    /proc/stat, /proc/net/dev and /proc/diskstats stay open, rates are computed from the counters of the
+    previous call (first values are read at creation). changed is set when CPU cores, network interfaces or
+    disks appear or disappear, so discovery configs can be updated.
+    """
+
+    def __init__(self, logger_obj, top=5):
+        self.logger = logger_obj
+        self.top = top
+        self.cores = []
+        self.interfaces = []
+        self.disks = []
+        self.changed = False
+        self._files = {}
+        self._previous = {}
+        self._process_buffer = bytearray(1024)
+        self._lock = threading.Lock()
+        for name, path in (('stat', '/proc/stat'), ('net', '/proc/net/dev'), ('disks', '/proc/diskstats')):
+            try:
+                self._files[name] = ProcFile(path)
+            except OSError as e:
+                self.logger.error('Error open {}: {}'.format(path, e))
+        for name in ('cpu', 'network', 'diskio'):
+            try:
+                getattr(self, name)()
+            except Exception as e:
+                self.logger.error('Error read {} statistics: {}'.format(name, e))
+        self.changed = False
+
+    def close(self):
+        for proc_file in self._files.values():
+            proc_file.close()
+        self._files = {}
+
+    def _counters(self, name, counters):
+        """Store counters, return previous counters and seconds elapsed since them."""
+        now = time.monotonic()
+        previous, previous_time = self._previous.get(name, ({}, now))
+        self._previous[name] = (counters, now)
+        return previous, now - previous_time
+
+    def _update_names(self, attribute, names):
+        if names != getattr(self, attribute):
+            setattr(self, attribute, names)
+            self.changed = True
+
+    def cpu(self) -> dict:
+        """Utilisation of all CPUs (cpu_use) and each core (cpu<N>_use), %."""
+        counters = {}
+        for line in self._files['stat'].read().split(b'\n'):
+            if not line.startswith(b'cpu'):
+                break
+            fields = line.split()
+            values = [int(value) for value in fields[1:9]]
+            # idle + iowait, total.
+            counters[fields[0].decode()] = (values[3] + values[4], sum(values))
+        with self._lock:
+            previous, _ = self._counters('cpu', counters)
+            self._update_names('cores', sorted((name for name in counters if name != 'cpu'),
+                                               key=lambda name: int(name[3:])))
+        payload = {}
+        for name, (idle, total) in counters.items():
+            idle_previous, total_previous = previous.get(name, (idle, total))
+            delta = total - total_previous
+            use = 100. * (1. - (idle - idle_previous) / delta) if delta > 0 else 0.
+            payload['{}_use'.format(name)] = '{0:.1f}'.format(use)
+        return payload
+
+    def load(self) -> dict:
+        load = os.getloadavg()
+        return {'load_1': '{0:.2f}'.format(load[0]), 'load_5': '{0:.2f}'.format(load[1]),
+                'load_15': '{0:.2f}'.format(load[2])}
+
+    def network(self) -> dict:
+        """Receive and transmit rate of each interface (except lo): net_rx_<if>, net_tx_<if> (kB/s),
+        net_rx_packets_<if>, net_tx_packets_<if> (packets/s)."""
+        counters = {}
+        for line in self._files['net'].read().split(b'\n')[2:]:
+            name, separator, values = line.partition(b':')
+            name = name.strip().decode()
+            if not separator or name == 'lo':
+                continue
+            fields = values.split()
+            counters[name] = (int(fields[0]), int(fields[1]), int(fields[8]), int(fields[9]))
+        with self._lock:
+            previous, elapsed = self._counters('network', counters)
+            self._update_names('interfaces', sorted(counters))
+        payload = {}
+        for name, values in counters.items():
+            old = previous.get(name, values)
+            interface = name.replace('-', '_').replace('.', '_')
+            payload['net_rx_{}'.format(interface)] = '{0:.1f}'.format(_rate(values[0], old[0], elapsed) / 1024)
+            payload['net_rx_packets_{}'.format(interface)] = '{0:.1f}'.format(_rate(values[1], old[1], elapsed))
+            payload['net_tx_{}'.format(interface)] = '{0:.1f}'.format(_rate(values[2], old[2], elapsed) / 1024)
+            payload['net_tx_packets_{}'.format(interface)] = '{0:.1f}'.format(_rate(values[3], old[3], elapsed))
+        return payload
+
+    def diskio(self) -> dict:
+        """Read and write rate of each disk: disk_read_<disk>, disk_write_<disk> (kB/s),
+        disk_read_iops_<disk>, disk_write_iops_<disk> (operations/s)."""
+        counters = {}
+        disks = set(os.listdir('/sys/block'))
+        for line in self._files['disks'].read().split(b'\n'):
+            fields = line.split()
+            if len(fields) < 10:
+                continue
+            name = fields[2].decode()
+            if name.startswith(SKIP_DISKS) or name not in disks:
+                continue
+            # Reads completed, sectors read, writes completed, sectors written.
+            counters[name] = (int(fields[3]), int(fields[5]), int(fields[7]), int(fields[9]))
+        with self._lock:
+            previous, elapsed = self._counters('diskio', counters)
+            self._update_names('disks', sorted(counters))
+        payload = {}
+        for name, values in counters.items():
+            old = previous.get(name, values)
+            payload['disk_read_{}'.format(name)] = '{0:.1f}'.format(_rate(values[1], old[1], elapsed) / 2)
+            payload['disk_read_iops_{}'.format(name)] = '{0:.1f}'.format(_rate(values[0], old[0], elapsed))
+            payload['disk_write_{}'.format(name)] = '{0:.1f}'.format(_rate(values[3], old[3], elapsed) / 2)
+            payload['disk_write_iops_{}'.format(name)] = '{0:.1f}'.format(_rate(values[2], old[2], elapsed))
+        return payload
+
+    def _read_process(self, pid):
+        """Return name, CPU ticks and RSS bytes of the process or None if it has exited."""
+        try:
+            fd = os.open('/proc/{}/stat'.format(pid), os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            length = os.readv(fd, [self._process_buffer])
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+        data = bytes(memoryview(self._process_buffer)[:length])
+        # Name is in parentheses and may contain spaces.
+        name_end = data.rfind(b')')
+        fields = data[name_end + 2:].split()
+        return (data[data.find(b'(') + 1:name_end].decode('utf-8', 'replace'),
+                int(fields[11]) + int(fields[12]), int(fields[21]) * PAGE_SIZE)
+
+    def processes(self) -> dict:
+        """Top processes by CPU use since previous call (top_cpu_<i> %, top_cpu_<i>_name) and by resident
+        memory (top_rss_<i> MB, top_rss_<i>_name)."""
+        processes = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                process = self._read_process(entry)
+                if process is not None:
+                    processes[entry] = process
+        with self._lock:
+            previous, elapsed = self._counters('processes', processes)
+        cpu = []
+        for pid, (name, ticks, rss) in processes.items():
+            if pid in previous and elapsed > 0:
+                cpu.append((100. * max(0, ticks - previous[pid][1]) / CLOCK_TICKS / elapsed, name))
+        payload = {}
+        for i, (use, name) in enumerate(heapq.nlargest(self.top, cpu), 1):
+            payload['top_cpu_{}'.format(i)] = '{0:.1f}'.format(use)
+            payload['top_cpu_{}_name'.format(i)] = name
+        for i, (name, _, rss) in enumerate(heapq.nlargest(self.top, processes.values(), key=lambda p: p[2]), 1):
+            payload['top_rss_{}'.format(i)] = '{0:.1f}'.format(rss / 1048576)
+            payload['top_rss_{}_name'.format(i)] = name
+        return payload
+
+    def sensors(self, collectors) -> list:
+        """Return Metric of sensors of enabled collectors."""
+        sensors = []
+        if 'cpu' in collectors:
+            sensors.append(Metric('cpu_use', 'CPU use', unit='%', icon='mdi:cpu-64-bit'))
+            for core in self.cores:
+                sensors.append(Metric('{}_use'.format(core), '{} use'.format(core.upper()), unit='%',
+                                      icon='mdi:cpu-64-bit'))
+        if 'load' in collectors:
+            for minutes in (1, 5, 15):
+                sensors.append(Metric('load_{}'.format(minutes), 'Load {} min'.format(minutes), icon='mdi:gauge'))
+        if 'network' in collectors:
+            for name in self.interfaces:
+                interface = name.replace('-', '_').replace('.', '_')
+                for direction, title in (('rx', 'receive'), ('tx', 'transmit')):
+                    sensors.append(Metric('net_{}_{}'.format(direction, interface), '{} {}'.format(name, title),
+                                          unit='kB/s', icon='mdi:network'))
+                    sensors.append(Metric('net_{}_packets_{}'.format(direction, interface),
+                                          '{} {} packets'.format(name, title), unit='p/s', icon='mdi:network'))
+        if 'diskio' in collectors:
+            for name in self.disks:
+                for direction in ('read', 'write'):
+                    sensors.append(Metric('disk_{}_{}'.format(direction, name), 'Disk {} {}'.format(name, direction),
+                                          unit='kB/s', icon='mdi:harddisk'))
+                    sensors.append(Metric('disk_{}_iops_{}'.format(direction, name),
+                                          'Disk {} {} IOPS'.format(name, direction), unit='IOPS',
+                                          icon='mdi:harddisk'))
+        if 'processes' in collectors:
+            for i in range(1, self.top + 1):
+                sensors.append(Metric('top_cpu_{}'.format(i), 'Top CPU process {}'.format(i), unit='%',
+                                      icon='mdi:application'))
+                sensors.append(Metric('top_cpu_{}_name'.format(i), 'Top CPU process {} name'.format(i),
+                                      icon='mdi:application'))
+                sensors.append(Metric('top_rss_{}'.format(i), 'Top memory process {}'.format(i), unit='MB',
+                                      icon='mdi:application'))
+                sensors.append(Metric('top_rss_{}_name'.format(i), 'Top memory process {} name'.format(i),
+                                      icon='mdi:application'))
+        return sensors
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import socket
+
+
+class PublishBatch(object):
+    """Context manager that sends messages published inside it in as few TCP segments as possible.
+
+    On Linux the client socket is corked (TCP_CORK) for the block. On exit flush(info) is called with the
+    last message info, it must return when queued messages are written to the socket, then the socket is
+    uncorked and the kernel sends everything at once.
+    """
+
+    def __init__(self, client, flush):
+        self.client = client
+        self.flush = flush
+        self.last = None
+        self._sock = None
+
+    def __enter__(self):
+        sock = self.client.socket()
+        if sock is not None and hasattr(socket, 'TCP_CORK'):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+                self._sock = sock
+            except OSError:
+                pass
+        return self
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.last = self.client.publish(topic=topic, payload=payload, qos=qos, retain=retain)
+        return self.last
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._sock is None:
+            return
+        try:
+            if self.last is not None:
+                self.flush(self.last)
+        finally:
+            try:
+                self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+            except OSError:
+                pass
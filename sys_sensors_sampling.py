@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from array import array
+import math
+import threading
+
+AGGREGATES = ('min', 'max', 'mean', 'p95')
+
+
+class RingBuffer(object):
+    """Fixed-size buffer of float samples, oldest samples are overwritten."""
+
+    def __init__(self, size):
+        self.size = size
+        self._data = array('d', bytes(8 * size))
+        self._index = 0
+        self.count = 0
+
+    def append(self, value):
+        self._data[self._index] = value
+        self._index = (self._index + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def clear(self):
+        self._index = 0
+        self.count = 0
+
+    def values(self):
+        if self.count < self.size:
+            return self._data[:self.count]
+        return self._data[self._index:] + self._data[:self._index]
+
+    def aggregates(self, names=AGGREGATES) -> dict:
+        if not self.count:
+            return {}
+        values = sorted(self.values())
+        result = {}
+        for name in names:
+            if name == 'min':
+                result[name] = values[0]
+            elif name == 'max':
+                result[name] = values[-1]
+            elif name == 'mean':
+                result[name] = math.fsum(values) / len(values)
+            elif name.startswith('p') and name[1:].isdigit():
+                # Nearest-rank percentile.
+                rank = math.ceil(int(name[1:]) / 100. * len(values))
+                result[name] = values[min(max(rank, 1), len(values)) - 1]
+        return result
+
+
+class Sampler(object):
+    """Polls cheap metrics every interval seconds into ring buffers.
+
+    sources: metric name -> function returning float or None (sample skipped).
+    """
+
+    def __init__(self, logger_obj, sources, interval=0.5, size=1200, aggregates=AGGREGATES):
+        self.logger = logger_obj
+        self.sources = sources
+        self.interval = interval
+        self.aggregates = aggregates
+        self.buffers = {name: RingBuffer(size) for name in sources}
+        self.last = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        for name, source in self.sources.items():
+            try:
+                value = source()
+            except Exception as e:
+                self.logger.error('Error sample {}: {}'.format(name, e))
+                continue
+            if value is not None:
+                with self._lock:
+                    self.buffers[name].append(value)
+
+    def collect(self) -> dict:
+        """Return aggregates of samples since previous collect as payload values ('<metric>_<aggregate>').
+        Metric without new samples keeps previous values."""
+        with self._lock:
+            for name, buffer in self.buffers.items():
+                for aggregate, value in buffer.aggregates(self.aggregates).items():
+                    self.last['{}_{}'.format(name, aggregate)] = '{0:.1f}'.format(value)
+                buffer.clear()
+            return dict(self.last)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+import threading
+import time
+
+
+class Scheduler(object):
+    """Priority queue of periodic jobs (sensors), ordered by next due time."""
+
+    def __init__(self):
+        self.periods = {}
+        self._queue = []
+        self._lock = threading.Lock()
+
+    def add(self, name, period, delay=0.):
+        with self._lock:
+            self.periods[name] = float(period)
+            self._queue = [item for item in self._queue if item[1] != name]
+            heapq.heapify(self._queue)
+            heapq.heappush(self._queue, (time.monotonic() + delay, name))
+
+    def set_period(self, name, period):
+        """Change period of job. Next run time is kept, but not later than one new period from now."""
+        latest = time.monotonic() + period
+        with self._lock:
+            self.periods[name] = float(period)
+            self._queue = [(min(when, latest) if job == name else when, job) for when, job in self._queue]
+            heapq.heapify(self._queue)
+
+    def set_due(self, name, delay=0.):
+        """Run job in delay seconds, then with its period."""
+        self.add(name, self.periods[name], delay)
+
+    def reset(self):
+        """Make all jobs due now."""
+        now = time.monotonic()
+        with self._lock:
+            self._queue = [(now, name) for name in self.periods]
+            heapq.heapify(self._queue)
+
+    def pop_due(self, now=None) -> list:
+        """Return names of jobs that are due and schedule their next run."""
+        if now is None:
+            now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._queue and self._queue[0][0] <= now:
+                when, name = heapq.heappop(self._queue)
+                due.append(name)
+                when += self.periods[name]
+                if when <= now:
+                    # Missed runs are not caught up.
+                    when = now + self.periods[name]
+                heapq.heappush(self._queue, (when, name))
+        return due
+
+    def next_due(self, now=None) -> float:
+        """Return seconds until next job is due."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if not self._queue:
+                return min(self.periods.values(), default=1.)
+            return max(0., self._queue[0][0] - now)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from pytz import timezone
+import shlex
+from zoneinfo import ZoneInfo
+
 import yaml
 
 
@@ -39,12 +41,21 @@ class Settings(object):
         else:
             if self.settings['mqtt']['password'] is None:
                 self.settings['mqtt']['password'] = ''
+        if self.settings['mqtt'].get('reconnect_min') is None:
+            self.settings['mqtt']['reconnect_min'] = 0.5
+        else:
+            self.settings['mqtt']['reconnect_min'] = max(0.1, float(self.settings['mqtt']['reconnect_min']))
+        if self.settings['mqtt'].get('reconnect_max') is None:
+            self.settings['mqtt']['reconnect_max'] = 60.
+        else:
+            self.settings['mqtt']['reconnect_max'] = max(self.settings['mqtt']['reconnect_min'],
+                                                         float(self.settings['mqtt']['reconnect_max']))
         if 'timezone' not in self.settings:
             self.settings['timezone'] = 'Europe/Moscow'
         else:
             if self.settings['timezone'] is None:
                 self.settings['timezone'] = 'Europe/Moscow'
-        self.settings['timezone'] = timezone(self.settings["timezone"])
+        self.settings['timezone'] = ZoneInfo(self.settings['timezone'])
         if 'device_name' not in self.settings:
             self.settings['device_name'] = 'Device1'
         else:
@@ -72,6 +83,252 @@ class Settings(object):
                 self.settings['update_interval'] = 300.
             else:
                 self.settings['update_interval'] = int(self.settings['update_interval'])
+        if 'intervals' not in self.settings:
+            self.settings['intervals'] = {}
+        elif not isinstance(self.settings['intervals'], dict):
+            self.settings['intervals'] = {}
+        for sensor in ('memory', 'last_boot', 'disks', 'devices', 'temperature', 'sampling', 'agent', 'cpu', 'load',
+                       'network', 'diskio', 'processes'):
+            if self.settings['intervals'].get(sensor) is None:
+                self.settings['intervals'][sensor] = self.settings['update_interval']
+            else:
+                self.settings['intervals'][sensor] = max(1, int(self.settings['intervals'][sensor]))
+        if self.settings['intervals'].get('smart') is None:
+            self.settings['intervals']['smart'] = 3600
+        else:
+            self.settings['intervals']['smart'] = max(1, int(self.settings['intervals']['smart']))
+        if not isinstance(self.settings.get('adaptive'), dict):
+            self.settings['adaptive'] = {}
+        if self.settings['adaptive'].get('enabled') is not True:
+            self.settings['adaptive']['enabled'] = False
+        for key, default in (('min_interval', 5), ('max_interval', 600), ('samples', 10)):
+            if self.settings['adaptive'].get(key) is None:
+                self.settings['adaptive'][key] = default
+            else:
+                self.settings['adaptive'][key] = max(1, int(self.settings['adaptive'][key]))
+        self.settings['adaptive']['max_interval'] = max(self.settings['adaptive']['min_interval'],
+                                                        self.settings['adaptive']['max_interval'])
+        if not isinstance(self.settings['adaptive'].get('collectors'), list):
+            self.settings['adaptive']['collectors'] = ['disks', 'temperature', 'devices']
+        if not isinstance(self.settings['adaptive'].get('thresholds'), dict):
+            self.settings['adaptive']['thresholds'] = {'disk_use_': 90, 'soc_temperature': 70, 'temperature_': 55,
+                                                       'thermal_': 70}
+        self.settings['adaptive']['thresholds'] = {str(key): float(value) for key, value
+                                                   in self.settings['adaptive']['thresholds'].items()}
+        if 'sampling' not in self.settings:
+            self.settings['sampling'] = {}
+        elif not isinstance(self.settings['sampling'], dict):
+            self.settings['sampling'] = {}
+        if self.settings['sampling'].get('enabled') is not True:
+            self.settings['sampling']['enabled'] = False
+        if self.settings['sampling'].get('interval') is None:
+            self.settings['sampling']['interval'] = 0.5
+        else:
+            self.settings['sampling']['interval'] = max(0.05, float(self.settings['sampling']['interval']))
+        if self.settings['sampling'].get('size') is None:
+            self.settings['sampling']['size'] = 1200
+        else:
+            self.settings['sampling']['size'] = max(1, int(self.settings['sampling']['size']))
+        if not isinstance(self.settings['sampling'].get('aggregates'), list):
+            self.settings['sampling']['aggregates'] = ['min', 'max', 'mean', 'p95']
+        if 'publish' not in self.settings:
+            self.settings['publish'] = {}
+        elif not isinstance(self.settings['publish'], dict):
+            self.settings['publish'] = {}
+        if self.settings['publish'].get('mode') not in ('full', 'delta'):
+            self.settings['publish']['mode'] = 'full'
+        if self.settings['publish'].get('layout') not in ('json', 'topics'):
+            self.settings['publish']['layout'] = 'json'
+        if self.settings['publish'].get('codec') not in ('json', 'cbor', 'msgpack'):
+            self.settings['publish']['codec'] = 'json'
+        if self.settings['publish'].get('compress_min') is None:
+            self.settings['publish']['compress_min'] = 0
+        else:
+            self.settings['publish']['compress_min'] = max(0, int(self.settings['publish']['compress_min']))
+        if self.settings['publish'].get('key_dictionary') is not True:
+            self.settings['publish']['key_dictionary'] = False
+        if self.settings['publish'].get('keepalive') is None:
+            self.settings['publish']['keepalive'] = self.settings['update_interval']
+        else:
+            self.settings['publish']['keepalive'] = max(1, int(self.settings['publish']['keepalive']))
+        for deadband in ('deadband_abs', 'deadband_rel'):
+            if self.settings['publish'].get(deadband) is None:
+                self.settings['publish'][deadband] = 0.
+            else:
+                self.settings['publish'][deadband] = abs(float(self.settings['publish'][deadband]))
+        if not isinstance(self.settings['publish'].get('deadband'), dict):
+            self.settings['publish']['deadband'] = {}
+        for key, deadband in list(self.settings['publish']['deadband'].items()):
+            if not isinstance(deadband, dict):
+                self.settings['publish']['deadband'][key] = {'abs': abs(float(deadband))}
+        if 'outbox' not in self.settings:
+            self.settings['outbox'] = {}
+        elif not isinstance(self.settings['outbox'], dict):
+            self.settings['outbox'] = {}
+        if self.settings['outbox'].get('enabled') is not True:
+            self.settings['outbox']['enabled'] = False
+        if self.settings['outbox'].get('file') is None:
+            self.settings['outbox']['file'] = 'outbox.sqlite'
+        if self.settings['outbox'].get('eviction') not in ('oldest', 'downsample'):
+            self.settings['outbox']['eviction'] = 'oldest'
+        for key, default in (('max_rows', 10000), ('batch', 50)):
+            if self.settings['outbox'].get(key) is None:
+                self.settings['outbox'][key] = default
+            else:
+                self.settings['outbox'][key] = max(1, int(self.settings['outbox'][key]))
+        if self.settings['outbox'].get('rate') is None:
+            self.settings['outbox']['rate'] = 20.
+        else:
+            self.settings['outbox']['rate'] = max(0.1, float(self.settings['outbox']['rate']))
+        if not isinstance(self.settings.get('commands'), dict):
+            self.settings['commands'] = {}
+        if self.settings['commands'].get('queue') is None:
+            self.settings['commands']['queue'] = 10
+        else:
+            self.settings['commands']['queue'] = max(1, int(self.settings['commands']['queue']))
+        if self.settings['commands'].get('window') is None:
+            self.settings['commands']['window'] = 1.
+        else:
+            self.settings['commands']['window'] = max(0.01, float(self.settings['commands']['window']))
+        if not isinstance(self.settings['commands'].get('min_interval'), dict):
+            self.settings['commands']['min_interval'] = {}
+        for command, min_interval in (('force_update', 5.), ('reboot', 60.), ('shutdown', 60.)):
+            if self.settings['commands']['min_interval'].get(command) is None:
+                self.settings['commands']['min_interval'][command] = min_interval
+            else:
+                self.settings['commands']['min_interval'][command] = max(
+                    0., float(self.settings['commands']['min_interval'][command]))
+        if not isinstance(self.settings.get('history'), dict):
+            self.settings['history'] = {}
+        if self.settings['history'].get('enabled') is not True:
+            self.settings['history']['enabled'] = False
+        if self.settings['history'].get('file') is None:
+            self.settings['history']['file'] = 'history.bin'
+        for key, default in (('capacity', 100000), ('max_points', 1000), ('queue', 4)):
+            if self.settings['history'].get(key) is None:
+                self.settings['history'][key] = default
+            else:
+                self.settings['history'][key] = max(1, int(self.settings['history'][key]))
+        if 'collectors' not in self.settings:
+            self.settings['collectors'] = {}
+        elif not isinstance(self.settings['collectors'], dict):
+            self.settings['collectors'] = {}
+        if 'workers' not in self.settings['collectors']:
+            self.settings['collectors']['workers'] = 4
+        else:
+            if self.settings['collectors']['workers'] is None:
+                self.settings['collectors']['workers'] = 4
+            else:
+                self.settings['collectors']['workers'] = max(1, int(self.settings['collectors']['workers']))
+        if not isinstance(self.settings['collectors'].get('system'), list):
+            self.settings['collectors']['system'] = []
+        self.settings['collectors']['system'] = [
+            collector for collector in ('cpu', 'load', 'network', 'diskio', 'processes')
+            if collector in self.settings['collectors']['system']]
+        if self.settings['collectors'].get('top') is None:
+            self.settings['collectors']['top'] = 5
+        else:
+            self.settings['collectors']['top'] = max(1, int(self.settings['collectors']['top']))
+        if 'timeout' not in self.settings['collectors']:
+            self.settings['collectors']['timeout'] = {}
+        elif not isinstance(self.settings['collectors']['timeout'], dict):
+            self.settings['collectors']['timeout'] = {}
+        for collector, timeout in (('memory', 5.), ('last_boot', 5.), ('disks', 15.), ('devices', 5.),
+                                   ('temperature', 5.), ('sampling', 5.), ('agent', 5.), ('cpu', 5.), ('load', 5.),
+                                   ('network', 5.), ('diskio', 5.), ('processes', 10.)):
+            if self.settings['collectors']['timeout'].get(collector) is None:
+                self.settings['collectors']['timeout'][collector] = timeout
+            else:
+                self.settings['collectors']['timeout'][collector] = float(
+                    self.settings['collectors']['timeout'][collector])
+        if not isinstance(self.settings.get('thermal'), dict):
+            self.settings['thermal'] = {}
+        if not isinstance(self.settings['thermal'].get('aliases'), dict):
+            self.settings['thermal']['aliases'] = {}
+        if not isinstance(self.settings['thermal'].get('aggregates'), list):
+            self.settings['thermal']['aggregates'] = ['min', 'max']
+        self.settings['thermal']['aggregates'] = [aggregate for aggregate in ('min', 'max')
+                                                  if aggregate in self.settings['thermal']['aggregates']]
+        if self.settings['thermal'].get('rediscover') is None:
+            self.settings['thermal']['rediscover'] = 600.
+        else:
+            self.settings['thermal']['rediscover'] = max(1., float(self.settings['thermal']['rediscover']))
+        if not isinstance(self.settings.get('plugins'), dict):
+            self.settings['plugins'] = {}
+        if self.settings['plugins'].get('directory') is None:
+            self.settings['plugins']['directory'] = 'plugins'
+        enabled = self.settings['plugins'].get('enabled')
+        if isinstance(enabled, list):
+            enabled = {str(name): {} for name in enabled}
+        elif not isinstance(enabled, dict):
+            enabled = {}
+        self.settings['plugins']['enabled'] = {str(name): options if isinstance(options, dict) else {}
+                                               for name, options in enabled.items()}
+        if not isinstance(self.settings.get('brokers'), list):
+            self.settings['brokers'] = []
+        brokers = []
+        for broker in self.settings['brokers']:
+            if not isinstance(broker, dict) or not broker.get('hostname'):
+                self.logger.warning('Broker without hostname is skipped')
+                continue
+            brokers.append({'hostname': str(broker['hostname']),
+                            'port': int(broker.get('port') or 1883),
+                            'client_id': broker.get('client_id'),
+                            'user': broker.get('user'),
+                            'password': broker.get('password'),
+                            'qos': min(2, max(0, int(broker.get('qos', 1)))),
+                            'prefix': str(broker.get('prefix') or '').strip('/'),
+                            'queue': max(1, int(broker.get('queue') or 1000))})
+        self.settings['brokers'] = brokers
+        if 'aggregator' not in self.settings:
+            self.settings['aggregator'] = {}
+        elif not isinstance(self.settings['aggregator'], dict):
+            self.settings['aggregator'] = {}
+        if self.settings['aggregator'].get('enabled') is not True:
+            self.settings['aggregator']['enabled'] = False
+        hosts = []
+        if isinstance(self.settings['aggregator'].get('hosts'), list):
+            for host in self.settings['aggregator']['hosts']:
+                if isinstance(host, dict):
+                    address = host.get('address') or host.get('name')
+                    if address:
+                        hosts.append({'name': str(host.get('name') or address), 'address': str(address)})
+                elif host:
+                    hosts.append({'name': str(host), 'address': str(host)})
+        self.settings['aggregator']['hosts'] = hosts
+        if self.settings['aggregator'].get('transport') is None:
+            self.settings['aggregator']['transport'] = ['ssh', '-T', '-o', 'BatchMode=yes', '-o',
+                                                        'ServerAliveInterval=30', '{address}', 'sh']
+        elif not isinstance(self.settings['aggregator']['transport'], list):
+            self.settings['aggregator']['transport'] = shlex.split(str(self.settings['aggregator']['transport']))
+        if self.settings['aggregator'].get('interval') is None:
+            self.settings['aggregator']['interval'] = self.settings['update_interval']
+        else:
+            self.settings['aggregator']['interval'] = max(1, int(self.settings['aggregator']['interval']))
+        if self.settings['aggregator'].get('timeout') is None:
+            self.settings['aggregator']['timeout'] = 30.
+        else:
+            self.settings['aggregator']['timeout'] = max(1., float(self.settings['aggregator']['timeout']))
+        if self.settings['aggregator'].get('workers') is None:
+            self.settings['aggregator']['workers'] = 8
+        else:
+            self.settings['aggregator']['workers'] = max(1, int(self.settings['aggregator']['workers']))
+        if 'smartctl' not in self.settings['aggregator']:
+            self.settings['aggregator']['smartctl'] = 'smartctl'
+        elif not self.settings['aggregator']['smartctl']:
+            self.settings['aggregator']['smartctl'] = ''
+        if 'metrics' not in self.settings:
+            self.settings['metrics'] = {}
+        elif not isinstance(self.settings['metrics'], dict):
+            self.settings['metrics'] = {}
+        if self.settings['metrics'].get('enabled') is not True:
+            self.settings['metrics']['enabled'] = False
+        if self.settings['metrics'].get('prometheus_port') is None:
+            self.settings['metrics']['prometheus_port'] = 0
+        else:
+            self.settings['metrics']['prometheus_port'] = max(0, int(self.settings['metrics']['prometheus_port']))
+        if self.settings['metrics'].get('prometheus_host') is None:
+            self.settings['metrics']['prometheus_host'] = '127.0.0.1'
         if 'reboot/shutdown' not in self.settings:
             self.settings['reboot/shutdown'] = False
         else:
@@ -87,6 +344,11 @@ class Settings(object):
         else:
             if self.settings['homeassistant'] is not True:
                 self.settings['homeassistant'] = False
+        if 'asyncio' not in self.settings:
+            self.settings['asyncio'] = False
+        else:
+            if self.settings['asyncio'] is not True:
+                self.settings['asyncio'] = False
         if 'topic' not in self.settings:
             self.settings['topic'] = 'devices'
         else:
@@ -95,11 +357,34 @@ class Settings(object):
 
     def read_settings(self):
         try:
-            with open('settings.yaml') as f:
+            with open(self.settings_file) as f:
                 try:
                     self.settings = yaml.safe_load(f)
                 except yaml.YAMLError:
                     self.settings = {}
         except FileNotFoundError:
             self.settings = {}
+        if not isinstance(self.settings, dict):
+            self.settings = {}
         self.check_settings()
+
+    def reload_settings(self):
+        """Read settings file again. Return new checked settings or None if the file is invalid
+        (self.settings is not changed)."""
+        try:
+            with open(self.settings_file) as f:
+                settings = yaml.safe_load(f)
+        except (OSError, yaml.YAMLError) as e:
+            self.logger.error('Error read settings file {}: {}'.format(self.settings_file, e))
+            return None
+        if not isinstance(settings, dict):
+            self.logger.error('Error read settings file {}: not a mapping'.format(self.settings_file))
+            return None
+        checked = Settings(self.logger, self.settings_file)
+        checked.settings = settings
+        try:
+            checked.check_settings()
+        except (KeyError, TypeError, ValueError) as e:
+            self.logger.error('Error in settings file {}: {}'.format(self.settings_file, e))
+            return None
+        return checked.settings
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import fnmatch
+import json
+import subprocess
+import threading
+import time
+from typing import NamedTuple, Optional
+
+
+class SmartRecord(NamedTuple):
+    """SMART data of one device, as read by the last refresh."""
+    device: str
+    serial: str
+    model: str
+    temperature: Optional[int]
+    power_cycle_count: Optional[int]
+    power_on_hours: Optional[int]
+    updated: float
+
+    def as_payload(self) -> dict:
+        """Return state values as strings, '-1' for missing values."""
+        return {key: str(value) if value is not None else '-1'
+                for key, value in (('temperature', self.temperature),
+                                   ('power_cycle_count', self.power_cycle_count),
+                                   ('power_on_hours', self.power_on_hours))}
+
+
+def device_name_from_serial(serial: str) -> str:
+    """Return the device name used in payload keys and discovery ids.
+
+    Keeps the format of the former 'smartctl -i' text parsing (leading space included),
+    so entity ids in Home Assistant do not change.
+    """
+    return ' {}'.format(' '.join(serial.split())).replace('-', '_')
+
+
+def _raw_int(attribute: dict) -> Optional[int]:
+    raw = attribute.get('raw', {})
+    string = str(raw.get('string', '')).strip()
+    # 'Power_On_Hours_and_Msec' raw string looks like '12345h+12m+34.567s'.
+    token = string.split(' ')[0].split('h')[0] if string else ''
+    if token.isdigit():
+        return int(token)
+    value = raw.get('value')
+    return value if isinstance(value, int) else None
+
+
+def parse_smart_json(device: str, data: dict) -> Optional[SmartRecord]:
+    """Build SmartRecord from 'smartctl --json -i -A' output. Return None if there is no serial number."""
+    serial = data.get('serial_number')
+    if not serial:
+        return None
+    attributes = {}
+    for attribute in data.get('ata_smart_attributes', {}).get('table', []):
+        attributes[attribute.get('name')] = attribute
+    temperature = data.get('temperature', {}).get('current')
+    if temperature is None and 'Temperature_Celsius' in attributes:
+        temperature = _raw_int(attributes['Temperature_Celsius'])
+    power_cycle_count = data.get('power_cycle_count')
+    if power_cycle_count is None and 'Power_Cycle_Count' in attributes:
+        power_cycle_count = _raw_int(attributes['Power_Cycle_Count'])
+    power_on_hours = data.get('power_on_time', {}).get('hours')
+    if power_on_hours is None:
+        for name in ('Power_On_Hours', 'Power_On_Hours_and_Msec'):
+            if name in attributes:
+                power_on_hours = _raw_int(attributes[name])
+                break
+    return SmartRecord(device=device,
+                       serial=serial,
+                       model=data.get('model_name', ''),
+                       temperature=temperature,
+                       power_cycle_count=power_cycle_count,
+                       power_on_hours=power_on_hours,
+                       updated=time.time())
+
+
+class SmartCollector(object):
+    """Per-device SMART cache, refreshed in background thread.
+
+    Each refresh runs 'smartctl --scan' once and one 'smartctl -i -A' per device. Devices in standby are
+    not woken up ('-n standby'), their cached record is kept. Readers (get_devices) never call smartctl.
+    """
+
+    def __init__(self, logger_obj, interval=3600., pattern='/dev/sd*', timeout=60.):
+        self.logger = logger_obj
+        self.interval = interval
+        self.pattern = pattern
+        self.timeout = timeout
+        self.devices = {}
+        self.records = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+        self.on_change = None
+
+    def _parse_output(self, args, output) -> Optional[dict]:
+        try:
+            return json.loads(output.decode('utf-8', 'replace'))
+        except ValueError:
+            self.logger.error('Error parse smartctl {} output'.format(' '.join(args)))
+            return None
+
+    def _smartctl(self, *args) -> Optional[dict]:
+        try:
+            result = subprocess.run(['smartctl', '--json'] + list(args), stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.logger.error('Error run smartctl {}: {}'.format(' '.join(args), e))
+            return None
+        return self._parse_output(args, result.stdout)
+
+    async def _smartctl_async(self, *args) -> Optional[dict]:
+        import asyncio
+        try:
+            process = await asyncio.create_subprocess_exec('smartctl', '--json', *args, stdout=subprocess.PIPE,
+                                                           stderr=subprocess.DEVNULL)
+        except OSError as e:
+            self.logger.error('Error run smartctl {}: {}'.format(' '.join(args), e))
+            return None
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            self.logger.error('Error run smartctl {}: timeout'.format(' '.join(args)))
+            return None
+        return self._parse_output(args, output)
+
+    def _scan_devices(self, data) -> list:
+        if data is None:
+            return []
+        devices = []
+        for device in data.get('devices', []):
+            name = device.get('name', '')
+            if fnmatch.fnmatch(name, self.pattern) and name not in devices:
+                devices.append(name)
+        return devices
+
+    def _device_record(self, device, data) -> Optional[SmartRecord]:
+        if data is None:
+            return None
+        if data.get('smartctl', {}).get('exit_status', 0) & 2 and 'serial_number' not in data:
+            self.logger.debug('Device {} is in standby, SMART data not updated'.format(device))
+            return None
+        return parse_smart_json(device, data)
+
+    def scan(self) -> list:
+        return self._scan_devices(self._smartctl('--scan'))
+
+    def read_device(self, device: str) -> Optional[SmartRecord]:
+        return self._device_record(device, self._smartctl('-n', 'standby', '-i', '-A', device))
+
+    def _update(self, results) -> bool:
+        """Update cache from list of (device, SmartRecord or None). Return True if list of devices changed."""
+        with self._lock:
+            known = {record.device: name for name, record in self.records.items()}
+            devices = {}
+            records = {}
+            for device, record in results:
+                if record is not None:
+                    name = device_name_from_serial(record.serial)
+                    devices[name] = device
+                    records[name] = record
+                elif device in known:
+                    # Standby or read error: keep cached record.
+                    name = known[device]
+                    devices[name] = device
+                    records[name] = self.records[name]
+            changed = set(devices) != set(self.devices)
+            self.devices = devices
+            self.records = records
+        return changed
+
+    def refresh(self) -> bool:
+        """Read SMART data of all devices. Return True if list of devices changed."""
+        self.logger.debug('Refresh SMART cache')
+        return self._update([(device, self.read_device(device)) for device in self.scan()])
+
+    async def refresh_async(self, concurrency=4) -> bool:
+        """Same as refresh, smartctl runs as asyncio subprocesses (at most concurrency at once)."""
+        import asyncio
+        self.logger.debug('Refresh SMART cache')
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def read(device):
+            async with semaphore:
+                data = await self._smartctl_async('-n', 'standby', '-i', '-A', device)
+            return device, self._device_record(device, data)
+
+        devices = self._scan_devices(await self._smartctl_async('--scan'))
+        return self._update(await asyncio.gather(*[read(device) for device in devices]))
+
+    def get_records(self) -> dict:
+        with self._lock:
+            return dict(self.records)
+
+    def get_devices(self) -> dict:
+        with self._lock:
+            return dict(self.devices)
+
+    def _run(self, delay):
+        if delay:
+            self._wake_event.wait(delay)
+            self._wake_event.clear()
+        while not self._stop_event.is_set():
+            try:
+                if self.refresh() and self.on_change is not None:
+                    self.on_change()
+            except Exception as e:
+                self.logger.error('Error refresh SMART cache: {}'.format(e))
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+    def request_refresh(self):
+        """Refresh cache now (block device added or removed)."""
+        self._wake_event.set()
+
+    def start(self, delay=0.):
+        """Start refresh thread. First refresh is made in delay seconds or on request_refresh."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(delay,), name='smart', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
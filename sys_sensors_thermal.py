@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import re
+import threading
+import time
+
+from sys_sensors_plugins import Metric
+
+HWMON_GLOB = '/sys/class/hwmon/hwmon*'
+THERMAL_ZONES_GLOB = '/sys/class/thermal/thermal_zone*'
+# Sensors of SOC temperature, the first one found is used.
+SOC_SENSORS = ('soc_thermal', 'sun4i_ts', 'cpu_thermal', 'cpu0_thermal')
+THERMAL_AGGREGATES = ('min', 'max')
+
+
+def sensor_name(name) -> str:
+    return re.sub(r'[^a-z0-9]+', '_', name.strip().lower()).strip('_')
+
+
+def _read_text(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+class ThermalSensor(object):
+    """Temperature file in sysfs (millidegrees Celsius) kept open and reread with pread."""
+
+    def __init__(self, name, chip, path):
+        self.name = name
+        self.chip = chip
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self) -> float:
+        return int(os.pread(self.fd, 32, 0)) / 1000.
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ThermalZones(object):
+    """All hwmon temperatures and thermal zones read from sysfs.
+
+    Temperature files are found once and kept open, they are searched again every rediscover seconds or
+    after a read error (hot-plugged or removed sensors). A thermal zone that is also registered as hwmon
+    with the same name is read once. changed is set when the list of sensors changes, so discovery configs
+    can be updated.
+    """
+
+    def __init__(self, logger_obj, aliases=None, aggregates=THERMAL_AGGREGATES, rediscover=600.):
+        self.logger = logger_obj
+        self.aliases = aliases or {}
+        self.aggregates = aggregates
+        self.rediscover = rediscover
+        self.zones = []
+        self.changed = False
+        self._due = 0.
+        self._lock = threading.Lock()
+        self.discover()
+        self.changed = False
+
+    def _find(self) -> list:
+        """Return (name, chip, path) of temperature files."""
+        found = []
+        for hwmon in sorted(glob.glob(HWMON_GLOB), key=lambda path: int(re.sub(r'\D', '', path) or 0)):
+            chip = sensor_name(_read_text(os.path.join(hwmon, 'name')) or os.path.basename(hwmon))
+            inputs = sorted(glob.glob(os.path.join(hwmon, 'temp*_input')),
+                            key=lambda path: int(re.sub(r'\D', '', os.path.basename(path)) or 0))
+            for path in inputs:
+                if len(inputs) == 1:
+                    name = chip
+                else:
+                    label = _read_text(path[:-len('input')] + 'label')
+                    name = '{}_{}'.format(chip, sensor_name(label) or os.path.basename(path)[4:-6])
+                found.append((name, chip, path))
+        names = {name for name, _, _ in found}
+        for zone in sorted(glob.glob(THERMAL_ZONES_GLOB), key=lambda path: int(re.sub(r'\D', '', path) or 0)):
+            chip = sensor_name(_read_text(os.path.join(zone, 'type')) or os.path.basename(zone))
+            name = chip
+            if name in names:
+                continue
+            if any(other.startswith(chip + '_') for other in names):
+                name = '{}_{}'.format(chip, os.path.basename(zone)[len('thermal_zone'):])
+            names.add(name)
+            found.append((name, chip, os.path.join(zone, 'temp')))
+        return found
+
+    def discover(self):
+        found = self._find()
+        with self._lock:
+            opened = {sensor.path: sensor for sensor in self.zones}
+            sensors = []
+            for name, chip, path in found:
+                sensor = opened.pop(path, None)
+                if sensor is None or sensor.name != name:
+                    if sensor is not None:
+                        sensor.close()
+                    try:
+                        sensor = ThermalSensor(name, chip, path)
+                    except OSError as e:
+                        self.logger.debug('Error open {}: {}'.format(path, e))
+                        continue
+                try:
+                    sensor.read()
+                except (OSError, ValueError) as e:
+                    # Sensor without value is skipped until the next discovery.
+                    self.logger.debug('Error read {}: {}'.format(path, e))
+                    sensor.close()
+                    continue
+                sensors.append(sensor)
+            for sensor in opened.values():
+                sensor.close()
+            if [sensor.name for sensor in sensors] != [sensor.name for sensor in self.zones]:
+                self.logger.info('Temperature sensors: {}'.format(', '.join(sensor.name for sensor in sensors)))
+                self.changed = True
+            self.zones = sensors
+            self._due = time.monotonic() + self.rediscover
+
+    def key(self, name) -> str:
+        return 'thermal_{}'.format(sensor_name(self.aliases.get(name, name)))
+
+    def read_soc(self):
+        """Return SOC temperature or None if there is no known sensor."""
+        with self._lock:
+            for chip in SOC_SENSORS:
+                for sensor in self.zones:
+                    if sensor.chip == chip:
+                        try:
+                            return sensor.read()
+                        except (OSError, ValueError):
+                            self._due = 0.
+                            return None
+        return None
+
+    def collect(self) -> dict:
+        """Return temperatures of all sensors, their aggregates and SOC temperature."""
+        if time.monotonic() >= self._due:
+            self.discover()
+        payload = {}
+        chips = {}
+        values = []
+        with self._lock:
+            for sensor in self.zones:
+                try:
+                    value = sensor.read()
+                except (OSError, ValueError) as e:
+                    # Removed sensor (or a sensor without value): search again on the next update.
+                    self.logger.debug('Error read {}: {}'.format(sensor.path, e))
+                    self._due = 0.
+                    continue
+                chips.setdefault(sensor.chip, value)
+                values.append(value)
+                payload[self.key(sensor.name)] = str(value)
+        soc = next((chips[chip] for chip in SOC_SENSORS if chip in chips), None)
+        payload['soc_temperature'] = str(soc) if soc is not None else '-1'
+        if values:
+            for aggregate in self.aggregates:
+                payload['thermal_{}'.format(aggregate)] = str(min(values) if aggregate == 'min' else max(values))
+        return payload
+
+    def sensors(self) -> list:
+        """Return Metric of every temperature and aggregate."""
+        with self._lock:
+            names = [sensor.name for sensor in self.zones]
+        metrics = [Metric(self.key(name), '{} temperature'.format(self.aliases.get(name, name)), unit='°C',
+                          device_class='temperature') for name in names]
+        if names:
+            metrics.extend(Metric('thermal_{}'.format(aggregate), 'Temperature {}'.format(aggregate), unit='°C',
+                                  device_class='temperature')
+                           for aggregate in self.aggregates)
+        return metrics
+
+    def close(self):
+        with self._lock:
+            for sensor in self.zones:
+                sensor.close()
+            self.zones = []
+            self._due = 0.
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import tempfile
+import unittest
+
+from sys_sensors_history import History
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'history.bin')
+        self.logger = logging.getLogger('test')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def reopen(self):
+        history = History(self.logger, self.path, 100)
+        history.open()
+        return history
+
+    def test_keys_added_after_reopen(self):
+        history = self.reopen()
+        history.append({'a': '1', 'b': '2'}, ts=1.)
+        history.close()
+        for ts, key in ((2., 'c'), (3., 'd')):
+            history = self.reopen()
+            history.append({'a': '3', key: '4'}, ts=ts)
+            history.close()
+        history = self.reopen()
+        self.assertEqual(history.keys, ['a', 'b', 'c', 'd'])
+        self.assertEqual(history.query(['c']), {'c': [[2., 4.]]})
+        self.assertEqual(history.query(['d']), {'d': [[3., 4.]]})
+        self.assertEqual(history.query(['a']), {'a': [[1., 1.], [2., 3.], [3., 3.]]})
+        history.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import tempfile
+import unittest
+
+from sys_sensors_outbox import Outbox
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.outbox = Outbox(logging.getLogger('test'), os.path.join(self.directory.name, 'outbox.sqlite'),
+                             max_rows=100, eviction='downsample')
+        self.outbox.open()
+
+    def tearDown(self):
+        self.outbox.close()
+        self.directory.cleanup()
+
+    def stored(self):
+        return [int(payload) for _, _, payload in self.outbox._db.execute(
+            'SELECT id, topic, payload FROM outbox ORDER BY id')]
+
+    def test_downsample_keeps_every_second_older_row(self):
+        for i in range(101):
+            self.outbox.put('state', str(i))
+        stored = self.stored()
+        self.assertEqual(len(stored), 76)
+        self.assertEqual(stored[:25], list(range(0, 50, 2)))
+        self.assertEqual(stored[25:], list(range(50, 101)))
+
+    def test_downsample_spacing_grows_on_later_passes(self):
+        for i in range(1000):
+            self.outbox.put('state', str(i))
+        stored = self.stored()
+        self.assertLessEqual(len(stored), 100)
+        self.assertEqual(stored[-1], 999)
+        gaps = [b - a for a, b in zip(stored, stored[1:])]
+        # Older rows are thinned more, spacing never shrinks towards the oldest rows.
+        self.assertEqual(gaps, sorted(gaps, reverse=True))
+        self.assertGreater(gaps[0], 2)
+        self.assertEqual(gaps[-1], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()